@@ -0,0 +1,109 @@
+"""
+Check that selector evaluation scales linearly with document size.
+
+Times a handful of selectors, one per combinator, and the Parser join
+helpers against documents of doubling size, and reports the time per node.
+Exits with status 1 if the fitted growth exponent of any case exceeds
+--max-exponent, so it can be used as a regression check:
+
+    python benchmarks/scaling.py --max-exponent 1.3
+"""
+from __future__ import print_function
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from jsonselect import jsonselect
+
+
+def make_document(records, seed=0):
+    """A list of records, each nesting a few levels of objects and arrays."""
+    rand = random.Random(seed)
+    return [{
+        'id': i,
+        'name': 'record %d' % i,
+        'tags': ['a', 'b', 'c'][:rand.randint(0, 3)],
+        'meta': {
+            'level': rand.choice(['info', 'warn', 'error']),
+            'owner': {'name': 'owner %d' % rand.randint(0, 9)},
+        },
+    } for i in range(records)]
+
+
+SELECTORS = [
+    ('descendant', '.meta .name'),
+    ('child', '.meta > .level'),
+    ('sibling', '.id ~ .name'),
+    ('grouping', '.id, .level'),
+]
+
+
+def _validators(selector):
+    """The validators of the first simple selector of selector."""
+    return jsonselect.compile(selector).chains[0][0][1].validators
+
+
+def _join(helper, lhs_selector, rhs_selector):
+    lhs_validators = _validators(lhs_selector)
+    rhs_validators = _validators(rhs_selector)
+
+    def run(doc):
+        nodes = list(jsonselect.object_iter(doc))
+        lhs = [node for node in nodes
+               if all(validate(node) for validate in lhs_validators)]
+        rhs = [node for node in nodes
+               if all(validate(node) for validate in rhs_validators)]
+        return helper(lhs, rhs)
+    return run
+
+
+def cases():
+    for name, selector in SELECTORS:
+        yield name, jsonselect.compile(selector).match
+    yield 'join parents', _join(jsonselect.Parser.parents, '.meta', '.level')
+    yield 'join ancestors', _join(jsonselect.Parser.ancestors,
+                                  'object', '.name')
+    yield 'join siblings', _join(jsonselect.Parser.siblings, '.id', '.name')
+
+
+def measure(func, doc, repeat):
+    return min(timeit.repeat(lambda: func(doc), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--start', type=int, default=1000,
+                        help="records in the smallest document")
+    parser.add_argument('--steps', type=int, default=5,
+                        help="number of times the document size doubles")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-exponent', type=float, default=None,
+                        help="fail if time grows faster than size**N")
+    args = parser.parse_args()
+
+    sizes = [args.start * 2 ** i for i in range(args.steps + 1)]
+    docs = [make_document(size) for size in sizes]
+    counts = [sum(1 for _ in jsonselect.object_iter(doc)) for doc in docs]
+
+    failed = False
+    for name, func in cases():
+        times = [measure(func, doc, args.repeat) for doc in docs]
+        exponent = (math.log(times[-1] / times[0]) /
+                    math.log(counts[-1] / float(counts[0])))
+        print('%-16s' % name, ' '.join('%7.2fus' % (t / n * 1e6)
+                                       for t, n in zip(times, counts)),
+              ' exponent %.2f' % exponent)
+        if args.max_exponent is not None and exponent > args.max_exponent:
+            failed = True
+
+    print('nodes:', ' '.join(str(n) for n in counts))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""
+Benchmark each part of jsonselect and compare against a stored baseline.
+
+Runs a fixed set of cases, grouped by subsystem (traversal, combinators,
+:has, :expr, joins, parsing, the conformance selectors, the command line
+and startup: the cost of importing and of running the command line on a
+tiny document), over synthetic documents: wide arrays, deep nesting, many
+small records and large strings. For each case it reports nodes per second,
+the median and 90th percentile latency over the runs and the peak memory
+allocated:
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --save benchmarks/baseline.json
+    python benchmarks/suite.py --compare benchmarks/baseline.json
+
+With --compare, cases whose median is more than --threshold times the
+baseline's are reported, and the exit status is 1 if there are any. Cases
+the baseline doesn't have are listed too, so they can be saved.
+Baselines only mean something on the machine they were saved on.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from jsonselect import jsonselect
+
+
+def wide(size):
+    """A single array of scalars."""
+    return [i if i % 3 else 'item %d' % i for i in range(size)]
+
+
+def deep(size, depth=200):
+    """Chains of objects nested depth levels deep."""
+    doc = []
+    for _ in range(max(1, size // depth)):
+        branch = {'leaf': True}
+        for i in range(depth):
+            branch = {'k%d' % (i % 3): branch, 'n': i}
+        doc.append(branch)
+    return doc
+
+
+def records(size, seed=0):
+    """Many small records, like a decoded API response."""
+    rand = random.Random(seed)
+    return [{
+        'id': i,
+        'name': 'record %d' % i,
+        'price': rand.randint(0, 1000),
+        'tags': ['a', 'b', 'c'][:rand.randint(0, 3)],
+        'meta': {
+            'level': rand.choice(['info', 'warn', 'error']),
+            'owner': {'name': 'owner %d' % rand.randint(0, 9)},
+        },
+    } for i in range(size // 12)]
+
+
+def strings(size, length=4096):
+    """Fewer nodes, each a large string."""
+    return [{'id': i, 'body': ('lorem ipsum %d ' % i) * (length // 14)}
+            for i in range(max(1, size // 64))]
+
+
+DOCUMENTS = [('wide', wide), ('deep', deep), ('records', records),
+             ('strings', strings)]
+
+
+# (subsystem, document, selector)
+SELECTORS = [
+    ('traversal', 'wide', '*'),
+    ('traversal', 'deep', '*'),
+    ('traversal', 'records', '*'),
+    ('traversal', 'strings', 'string'),
+    ('types', 'records', 'number'),
+    ('keys', 'records', '.name'),
+    ('descendant', 'records', '.meta .name'),
+    ('descendant', 'deep', '.k0 .leaf'),
+    ('child', 'records', '.meta > .level'),
+    ('sibling', 'records', '.id ~ .tags'),
+    ('grouping', 'records', '.id, .level, .name'),
+    ('nth-child', 'wide', ':nth-child(3n+1)'),
+    ('has', 'records', 'object:has(.level:val("error")) > .id'),
+    ('has', 'deep', ':has(.leaf)'),
+    ('expr', 'wide', ':expr(x <= 100 || x >= 1000)'),
+    ('expr', 'records', '.price:expr(x * 2 = 500)'),
+    ('val', 'strings', '.body:contains("ipsum 7 ")'),
+]
+
+JOINS = [
+    ('parents', 'records', '.meta', '.level'),
+    ('ancestors', 'records', 'object', '.name'),
+    ('siblings', 'records', '.id', '.name'),
+]
+
+
+def _matcher(selector):
+    compiled = jsonselect.compile(selector)
+    return lambda doc: len(compiled.match(doc))
+
+
+def _join(helper, lhs_selector, rhs_selector):
+    lhs = jsonselect.compile(lhs_selector).chains[0][0][1].validators
+    rhs = jsonselect.compile(rhs_selector).chains[0][0][1].validators
+
+    def run(doc):
+        nodes = list(jsonselect.object_iter(doc))
+        return len(helper(
+            [node for node in nodes if all(v(node) for v in lhs)],
+            [node for node in nodes if all(v(node) for v in rhs)]))
+    return run
+
+
+def _parse(selectors):
+    def run(doc):
+        for selector in selectors:
+            jsonselect.purge()
+            jsonselect.compile(selector)
+        return len(selectors)
+    return run
+
+
+def _parse_expr(expressions):
+    parser = jsonselect.Parser()
+
+    def run(doc):
+        for expression in expressions:
+            parser.parse_expr(jsonselect.lex_expr(expression))
+        return len(expressions)
+    return run
+
+
+def conformance_corpus():
+    """Return (selector, document) for each conformance test which
+    doesn't expect a syntax error."""
+    corpus = []
+    paths = []
+    # custom tests sit one level down, upstream ones two
+    for pattern in (('*', '*.selector'), ('*', '*', '*.selector')):
+        paths.extend(glob.glob(os.path.join(ROOT, 'conformance_tests',
+                                            *pattern)))
+    for path in sorted(paths):
+        directory, name = os.path.split(path)
+        with open(os.path.join(directory, name.split('_')[0] + '.json')) as f:
+            doc = json.load(f)
+        with open(path) as f:
+            selector = f.read().strip()
+        try:
+            jsonselect.compile(selector)
+        except jsonselect.SelectorSyntaxError:
+            continue
+        corpus.append((selector, doc))
+    return corpus
+
+
+def _corpus(corpus):
+    def run(doc):
+        for selector, doc in corpus:
+            jsonselect.compile(selector).match(doc)
+        return len(corpus)
+    return run
+
+
+def _cli(selector, path):
+    command = [sys.executable, '-m', 'jsonselect', '--machine-readable',
+               selector, path]
+
+    def run(doc):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(command, stdout=devnull, cwd=ROOT)
+        return 1
+    return run
+
+
+def _python(arguments, stdin=None):
+    command = [sys.executable] + arguments
+
+    def run(doc):
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                       stdout=devnull, cwd=ROOT)
+            process.communicate(stdin)
+        return 1
+    return run
+
+
+def cases(size, workdir):
+    """Yield (subsystem, name, document name, function) for every case.
+
+    Functions take the document and return a count of what they found.
+    """
+    for subsystem, doc_name, selector in SELECTORS:
+        yield subsystem, selector, doc_name, _matcher(selector)
+    for helper, doc_name, lhs, rhs in JOINS:
+        yield ('joins', '%s(%s, %s)' % (helper, lhs, rhs), doc_name,
+               _join(getattr(jsonselect.Parser, helper), lhs, rhs))
+
+    selectors = [selector for _, _, selector in SELECTORS]
+    yield 'parse', 'compile %d selectors' % len(selectors), None, _parse(
+        selectors)
+    expressions = ['(x <= 100 || x >= 1000)', '(x * 2 = 500)',
+                   '(x ^= "a" && x $= "b" || x = null)']
+    yield 'parse', 'parse_expr', None, _parse_expr(expressions)
+
+    corpus = conformance_corpus()
+    if corpus:
+        yield ('conformance', '%d selectors' % len(corpus), None,
+               _corpus(corpus))
+
+    path = os.path.join(workdir, 'records.json')
+    with open(path, 'w') as f:
+        json.dump(records(size), f)
+    yield 'cli', '.meta .name', None, _cli('.meta .name', path)
+
+    # the interpreter alone, which the other startup cases include
+    yield 'startup', 'python', None, _python(['-c', 'pass'])
+    yield 'startup', 'import jsonselect', None, _python(
+        ['-c', 'import jsonselect'])
+    yield 'startup', 'import jsonselect.jsonselect', None, _python(
+        ['-c', 'import jsonselect.jsonselect'])
+    yield 'startup', 'cli --help', None, _python(
+        ['-m', 'jsonselect', '--help'])
+    tiny = b'{"name": "tiny", "tags": ["a", "b"]}'
+    yield 'startup', 'cli .name < tiny', None, _python(
+        ['-m', 'jsonselect', '.name'], tiny)
+    yield 'startup', 'cli :expr() < tiny', None, _python(
+        ['-m', 'jsonselect', '.tags > :expr(x = "a")'], tiny)
+
+
+def percentile(times, fraction):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+
+def peak_memory(func, doc):
+    """Return the most memory allocated at once by func(doc), in bytes."""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func(doc)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(func, doc, nodes, repeat):
+    func(doc)   # warm up compile caches and imports
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func(doc)
+        times.append(timeit.default_timer() - start)
+    median = percentile(times, 0.5)
+    return {
+        'nodes_per_sec': nodes / median if nodes else None,
+        'p50': median,
+        'p90': percentile(times, 0.9),
+        'peak_bytes': peak_memory(func, doc),
+    }
+
+
+def report(key, result, baseline):
+    line = '%-12s %-48s' % key
+    if result['nodes_per_sec']:
+        line += ' %9.0f nodes/s' % result['nodes_per_sec']
+    else:
+        line += ' %17s' % ''
+    line += '  p50 %8.2fms p90 %8.2fms' % (result['p50'] * 1e3,
+                                            result['p90'] * 1e3)
+    if result['peak_bytes'] is not None:
+        line += '  peak %7.1fMB' % (result['peak_bytes'] / 1e6)
+    if baseline is not None:
+        line += '  x%.2f' % (result['p50'] / baseline['p50'])
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=100000,
+                        help="approximate number of nodes per document")
+    # the 90th percentile is the slowest run unless there are 20 or more
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="timed runs per case")
+    parser.add_argument('--only', default=None,
+                        help="run only the cases of this subsystem")
+    parser.add_argument('--save', metavar='FILE',
+                        help="store the results as a baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare the results with a stored baseline")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="with --compare, fail if a median is this many "
+                        "times slower than the baseline's")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored['size'] != args.size:
+            parser.error("the baseline was saved with --size %d" %
+                         stored['size'])
+
+    docs = dict((name, make(args.size)) for name, make in DOCUMENTS)
+    counts = dict((name, sum(1 for _ in jsonselect.object_iter(doc)))
+                  for name, doc in docs.items())
+
+    workdir = tempfile.mkdtemp()
+    results = {}
+    regressions = []
+    missing = []
+    try:
+        for subsystem, name, doc_name, func in cases(args.size, workdir):
+            if args.only and subsystem != args.only:
+                continue
+            if doc_name:
+                name = '%s [%s]' % (name, doc_name)
+            # the same selector may be run over several documents
+            key = '%s %s' % (subsystem, name)
+            result = run_case(func, docs.get(doc_name),
+                              counts.get(doc_name), args.repeat)
+            results[key] = result
+            report((subsystem, name), result, baseline.get(key))
+            if args.compare and key not in baseline:
+                missing.append(key)
+            elif (key in baseline and
+                    result['p50'] > baseline[key]['p50'] * args.threshold):
+                regressions.append(key)
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'size': args.size, 'python': sys.version.split()[0],
+                       'results': results}, f, indent=1, sort_keys=True)
+    if missing:
+        print('not in the baseline:', ', '.join(missing))
+    if regressions:
+        print('slower than the baseline:', ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
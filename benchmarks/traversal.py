@@ -0,0 +1,100 @@
+"""
+Compare traversal speed against the original recursive implementation.
+
+Counts nodes per second for object_iter and for evaluating the universal
+selector, on wide, deep and record-shaped documents, next to the
+recursive object_iter with namedtuple nodes which jsonselect used before:
+
+    python benchmarks/traversal.py
+"""
+from __future__ import print_function
+import argparse
+import collections
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from jsonselect import jsonselect
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+RecursiveNode = collections.namedtuple('Node', [
+    'value', 'parent', 'parent_key', 'idx', 'siblings'])
+
+
+def recursive_object_iter(obj, parent=None, parent_key=None, idx=None,
+                          siblings=None):
+    """object_iter as it was: a generator per level, a tuple per node."""
+    obj_node = RecursiveNode(value=obj, parent=parent, parent_key=parent_key,
+                             siblings=siblings, idx=idx)
+    if isinstance(obj, list):
+        _siblings = len(obj)
+        for i, elem in enumerate(obj):
+            for node in recursive_object_iter(elem, obj_node, None, i + 1,
+                                              _siblings):
+                yield node
+    elif isinstance(obj, Mapping):
+        for key in obj:
+            for node in recursive_object_iter(obj[key], obj_node, key):
+                yield node
+    yield obj_node
+
+
+def wide(size):
+    return list(range(size))
+
+
+def deep(size, depth=200):
+    doc = []
+    for _ in range(size // depth):
+        branch = 0
+        for i in range(depth):
+            branch = {'k%d' % (i % 3): branch}
+        doc.append(branch)
+    return doc
+
+
+def records(size):
+    return [{'id': i, 'name': 'n%d' % i, 'tags': ['a', 'b'],
+             'meta': {'ok': True}} for i in range(size // 7)]
+
+
+DOCUMENTS = [('wide', wide), ('deep', deep), ('records', records)]
+
+
+def drain(iterator):
+    return sum(1 for _ in iterator)
+
+
+IMPLEMENTATIONS = [
+    ('recursive object_iter', lambda doc: drain(recursive_object_iter(doc))),
+    ('object_iter', lambda doc: drain(jsonselect.object_iter(doc))),
+    ('select *', lambda doc: drain(jsonselect.iselect('*', doc))),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=200000,
+                        help="approximate number of nodes per document")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for doc_name, make in DOCUMENTS:
+        doc = make(args.size)
+        nodes = drain(jsonselect.object_iter(doc))
+        for name, func in IMPLEMENTATIONS:
+            best = min(timeit.repeat(lambda: func(doc), number=1,
+                                     repeat=args.repeat))
+            print('%-8s %-22s %10.0f nodes/s' % (doc_name, name,
+                                                 nodes / best))
+
+
+if __name__ == '__main__':
+    main()
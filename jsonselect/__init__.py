@@ -4,5 +4,60 @@ __author__ = 'Matthew Hooker'
 __license__ = 'ISC'
 __copyright__ = 'Copyright 2011 Matthew Hooker'
 
+import sys
 
-from .jsonselect import select
+# public name -> submodule defining it. submodules are only imported when
+# one of their names is first used, so that importing jsonselect, or
+# running it from the command line, only pays for what it needs.
+_EXPORTS = {
+    'select': 'jsonselect',
+    'compile': 'jsonselect',
+    'purge': 'jsonselect',
+    'Selector': 'jsonselect',
+    'iselect': 'jsonselect',
+    'select_first': 'jsonselect',
+    'exists': 'jsonselect',
+    'Document': 'jsonselect',
+    'collect_stats': 'jsonselect',
+    'Stats': 'jsonselect',
+    'limits': 'jsonselect',
+    'LimitExceeded': 'jsonselect',
+    'SelectorSyntaxError': 'jsonselect',
+    'stream_select': 'stream',
+    'SelectorSet': 'selectorset',
+    'WatchedDocument': 'watch',
+    'select_paths': 'paths',
+    'select_pointers': 'paths',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name == 'jsonselect':
+            # importing a name from the submodule used to bind it here
+            return importlib.import_module('.jsonselect', __name__)
+        if name not in _EXPORTS:
+            raise AttributeError("module %r has no attribute %r" %
+                                 (__name__, name))
+        module = importlib.import_module('.' + _EXPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_EXPORTS) | set(['jsonselect']))
+else:
+    from .jsonselect import select, compile, purge, Selector
+    from .jsonselect import iselect, select_first, exists
+    from .jsonselect import Document
+    from .jsonselect import collect_stats, Stats
+    from .jsonselect import limits, LimitExceeded
+    from .jsonselect import SelectorSyntaxError
+    from .stream import stream_select
+    from .selectorset import SelectorSet
+    from .watch import WatchedDocument
+    from .paths import select_paths, select_pointers
@@ -1,4 +1,5 @@
-from .jsonselect import select
+# modules are imported where they are needed, as most runs of the command
+# line select from a small input once and startup dominates.
 
 
 def parser():
@@ -11,29 +12,188 @@ def parser():
                        "works best on lists.")
     group.add_argument('--machine-readable', action='store_true',
                        help="Print json with no formatting")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--stream', action='store_true',
+                      help="read the input incrementally and print each "
+                      "match as soon as it is found. only selectors which "
+                      "can be decided from the path to a node are "
+                      "supported.")
+    mode.add_argument('--lines', action='store_true',
+                      help="read one JSON document per line (JSON Lines) "
+                      "and print the selection for each on its own line.")
+    parser.add_argument('--paths', '-p', action='store_true',
+                        help="print the JSON Pointer of each match instead "
+                        "of its value.")
+    parser.add_argument('--stats', action='store_true',
+                        help="print what the selection did and how long it "
+                        "took to stderr, as JSON.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="with --lines, or an infile holding an array, "
+                        "number of processes to spread the work across.")
+    parser.add_argument('--decoder', default='auto',
+                        help="JSON decoder to read input with: json, "
+                        "orjson, ujson, simdjson, or auto (the default) for "
+                        "the fastest one installed.")
+    parser.add_argument('--cache', action='store_true',
+                        help="keep the index of the input and the compiled "
+                        "selector on disk, in $JSONSELECT_CACHE or "
+                        "~/.cache/jsonselect, so later runs over the same "
+                        "input start faster.")
     parser.add_argument('selector')
     parser.add_argument('infile', nargs="?")
     return parser
 
 
+def print_value(value, args):
+    import json
+    if args.machine_readable:
+        print(json.dumps(value))
+    elif args.list:
+        print(value)
+    else:
+        print(json.dumps(value, indent=4))
+
+
 def cli():
     import sys
-    import json
-    import logging
-    logging.basicConfig()
     parser_ = parser()
     args = parser_.parse_args()
 
     if args.infile:
-        fin = open(args.infile)
+        fin = open(args.infile, 'rb')
     elif sys.stdin:
-        fin = sys.stdin
+        fin = getattr(sys.stdin, 'buffer', sys.stdin)
     else:
         parser_.print_help()
         sys.exit(1)
 
-    obj = json.load(fin)
-    selection = select(args.selector, obj)
+    from . import decoders
+    # 'auto' falls back on the standard library, so is always available
+    if args.decoder != 'auto':
+        try:
+            decoders.get(args.decoder)
+        except ValueError as e:
+            parser_.error(str(e))
+    if args.paths and (args.stream or args.lines):
+        parser_.error("--paths can't be used with --stream or --lines")
+    if args.stats and (args.stream or args.lines):
+        parser_.error("--stats can't be used with --stream or --lines")
+    if args.cache and (args.stream or args.lines):
+        parser_.error("--cache can't be used with --stream or --lines")
+
+    if args.stream:
+        from .stream import stream_select
+        found = False
+        try:
+            for value in stream_select(args.selector, fin):
+                found = True
+                print_value(value, args)
+        except ValueError as e:
+            parser_.error(str(e))
+        if not found:
+            sys.exit(2)
+        return
+
+    if args.lines:
+        from .lines import select_lines
+        found = False
+        try:
+            for result in select_lines(args.selector, fin, jobs=args.jobs,
+                                       decoder=args.decoder):
+                found = found or result != 'null'
+                sys.stdout.write(result + '\n')
+        except ValueError as e:
+            parser_.error(str(e))
+        if not found:
+            sys.exit(2)
+        return
+
+    if args.jobs > 1 and args.infile:
+        if args.cache or args.stats:
+            parser_.error("--cache and --stats can't be used with --jobs")
+        from .parallel import iter_matches
+        from .jsonselect import SelectorSyntaxError
+        try:
+            matches = list(iter_matches(args.selector, args.infile,
+                                        jobs=args.jobs))
+        except SelectorSyntaxError as e:
+            parser_.error(str(e))
+        if args.paths:
+            from .jsonselect import _pointer
+            print_pointers([_pointer(path) for path, _ in matches], args)
+            return
+        values = [value for _, value in matches]
+        print_results(values[0] if len(values) == 1 else values or None,
+                      args)
+        return
+
+    if args.cache:
+        from . import cache
+        cache.load_selectors()
+        load = cache.load_document
+    else:
+        load = decoders.load
+
+    if not args.stats:
+        try:
+            print_selection(load(fin, decoder=args.decoder, pause_gc=True),
+                            args, parser_)
+        finally:
+            if args.cache:
+                cache.save_selectors()
+        return
+
+    import json
+    import time
+    from .jsonselect import collect_stats
+    start = time.time()
+    obj = load(fin, decoder=args.decoder, pause_gc=True)
+    load_time = time.time() - start
+    with collect_stats() as stats:
+        try:
+            print_selection(obj, args, parser_)
+        finally:
+            report = stats.as_dict()
+            report['load_time'] = load_time
+            sys.stderr.write(json.dumps(report, indent=4,
+                                        sort_keys=True) + '\n')
+            if args.cache:
+                cache.save_selectors()
+
+
+def print_selection(obj, args, parser_):
+    from .jsonselect import select, compile, SelectorSyntaxError
+    if args.paths:
+        try:
+            nodes = compile(args.selector).match(obj)
+        except SelectorSyntaxError as e:
+            parser_.error(str(e))
+        print_pointers([node.pointer() for node in nodes], args)
+        return
+
+    try:
+        compile(args.selector)
+    except SelectorSyntaxError:
+        # select logs the error and returns False
+        import logging
+        logging.basicConfig()
+    print_results(select(args.selector, obj), args)
+
+
+def print_pointers(pointers, args):
+    import sys
+    if not pointers:
+        sys.exit(2)
+    if args.list:
+        for pointer in pointers:
+            print(pointer)
+    else:
+        print_value(pointers, args)
+
+
+def print_results(selection, args):
+    import sys
+    import json
     if not selection:
         sys.exit(2)
     if args.machine_readable:
@@ -47,4 +207,5 @@ def cli():
     else:
         print(json.dumps(selection, indent=4))
 
-cli()
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,73 @@
+"""
+Run selections from asyncio code without blocking the event loop.
+
+Public interface:
+    select, select_first, exists, select_pointers
+    like the functions of the same names in jsonselect, but run in an
+    executor. each returns an awaitable for the result.
+
+Selections run in the loop's default executor, a pool of threads, unless
+another is given. Compiled selectors are safe to share between threads, so
+any number of selections may be awaited at once, with asyncio.gather for
+instance. Threads only run one at a time while selecting, so this keeps
+the loop responsive rather than making selection faster; pass a
+concurrent.futures.ProcessPoolExecutor to spread large selections across
+processes. Selectors are then compiled again in each process, from their
+source, as compiled selectors can't be pickled.
+
+Invalid selectors raise SelectorSyntaxError when the function is called,
+before anything is run. The object must not be modified while a selection
+of it is pending.
+"""
+import asyncio
+
+from .jsonselect import compile
+from .paths import select_pointers as _select_pointers
+
+
+def _run(method, selector, obj, *args):
+    """Apply the named method of selector to obj, in the executor."""
+    if method == 'pointers':
+        return _select_pointers(selector, obj)
+    return getattr(compile(selector), method)(obj, *args)
+
+
+def _submit(executor, method, selector, obj, *args):
+    # a source string, unlike a Selector, can be sent to another process
+    source = compile(selector).selector
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor, _run, method, source, obj, *args)
+
+
+def select(selector, obj, executor=None):
+    """Return an awaitable for the matched values of obj, as
+    jsonselect.select would return them.
+
+    Unlike jsonselect.select, raises SelectorSyntaxError for an invalid
+    selector.
+    """
+    return _submit(executor, 'select', selector, obj)
+
+
+def select_first(selector, obj, default=None, executor=None):
+    """Return an awaitable for the first matched value of obj, or default.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return _submit(executor, 'first', selector, obj, default)
+
+
+def exists(selector, obj, executor=None):
+    """Return an awaitable for whether selector matches anything in obj.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return _submit(executor, 'exists', selector, obj)
+
+
+def select_pointers(selector, obj, executor=None):
+    """Return an awaitable for the JSON Pointer of each match in obj.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return _submit(executor, 'pointers', selector, obj)
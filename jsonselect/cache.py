@@ -0,0 +1,352 @@
+"""
+Keep document indexes and lexed selectors on disk, between runs.
+
+Public interface:
+    load_document
+    read a JSON document from a file object and return its Document,
+    reusing the index stored for the same content when there is one.
+
+    read_index, write_index
+    load or store the index of a single Document.
+
+    load_selectors, save_selectors
+    load or store the tokens selectors lex to, so compiling them needs no
+    regular expressions.
+
+    clear
+    remove everything stored.
+
+Files are kept in the directory named by the JSONSELECT_CACHE environment
+variable, or ~/.cache/jsonselect, unless another is given. Indexes are
+named and validated by the SHA-256 hash of the document's bytes, so an
+index is only ever used for the document it was built from. Stored tokens
+are validated by a hash of the lexer's patterns.
+
+An index file holds a magic number, the document's hash and a JSON header
+describing the arrays which follow: the parent, subtree end, postorder
+position, key and index of every node, and the key and type posting lists,
+each an array of native 64 bit integers. The arrays are memory mapped, not
+read, and Nodes are only made for the positions a selection looks at.
+"""
+import array
+import binascii
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from . import decoders
+from .jsonselect import (Document, Node, ARGS_SCANNER, EXPR_SCANNER,
+                         SCANNER, _lex_cache)
+
+_MAGIC = b'JSELIDX1'
+# the magic number, the document's hash and the length of the header
+_PREAMBLE = struct.Struct('<8s32sQ')
+_ARRAYS = ('parents', 'ends', 'post', 'key_ids', 'idxs', 'siblings',
+           'key_postings', 'key_offsets', 'type_postings', 'type_offsets')
+
+_SCANNERS = {'selector': SCANNER, 'expr': EXPR_SCANNER}
+_SELECTORS_FILE = 'selectors.json'
+# lexed selectors kept on disk
+_MAXSELECTORS = 4096
+
+
+def default_directory():
+    """Return the directory files are kept in by default."""
+    return os.environ.get('JSONSELECT_CACHE') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'jsonselect')
+
+
+def _replace(path, data):
+    """Write data to path atomically, creating its directory if needed."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in data:
+                f.write(chunk)
+        getattr(os, 'replace', os.rename)(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class _NodeTable(object):
+
+    """The Nodes of a stored index, made as they are looked up."""
+
+    def __init__(self, obj, index, keys):
+        self.obj = obj
+        self.parents = index['parents']
+        self.key_ids = index['key_ids']
+        self.idxs = index['idxs']
+        self.siblings = index['siblings']
+        self.keys = keys
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __getitem__(self, pos):
+        nodes = self._nodes
+        # climb to the nearest ancestor with a Node, then make the rest
+        missing = []
+        while pos >= 0 and pos not in nodes:
+            missing.append(pos)
+            pos = self.parents[pos]
+        node = nodes[pos] if pos >= 0 else None
+        for pos in reversed(missing):
+            if node is None:
+                node = Node(self.obj, None, None, None, None)
+            elif self.idxs[pos]:
+                idx = self.idxs[pos]
+                node = Node(node.value[idx - 1], node, None, idx,
+                            self.siblings[pos])
+            else:
+                key = self.keys[self.key_ids[pos]]
+                node = Node(node.value[key], node, key, None, None)
+            nodes[pos] = node
+        return node
+
+
+def _integers(mapped, begin, count):
+    """Return count native 64 bit integers from mapped, starting at begin.
+    They are viewed in place where memoryview can cast, and unpacked on
+    Python 2."""
+    if hasattr(memoryview, 'cast'):
+        return memoryview(mapped)[begin:begin + count * 8].cast('q')
+    return struct.unpack_from('=%dq' % count, mapped, begin)
+
+
+def _new_integers():
+    """Return an empty sequence of 64 bit integers to append to. Python 2's
+    array module has no 64 bit type, so it is a list there."""
+    if 'q' in getattr(array, 'typecodes', ''):
+        return array.array('q')
+    return []
+
+
+def _tobytes(values):
+    if isinstance(values, list):
+        return struct.pack('=%dq' % len(values), *values)
+    return values.tobytes()
+
+
+def _postings(names, postings, offsets):
+    return dict((name, postings[offsets[i]:offsets[i + 1]])
+                for i, name in enumerate(names))
+
+
+class _StoredDocument(Document):
+
+    """A Document whose index was read from disk rather than built."""
+
+    def __init__(self, obj, index, keys, types):
+        self.obj = obj
+        self.nodes = _NodeTable(obj, index, keys)
+        self.parents = index['parents']
+        self.ends = index['ends']
+        self.post = index['post']
+        self.keys = _postings(keys, index['key_postings'],
+                              index['key_offsets'])
+        self.types = _postings(types, index['type_postings'],
+                               index['type_offsets'])
+
+
+def write_index(document, path, digest):
+    """Store the index of document at path, under the hex digest of the
+    document's bytes.
+
+    Raises ValueError if the document has keys other than strings.
+    """
+    keys = list(document.keys)
+    key_ids = dict((key, i) for i, key in enumerate(keys))
+    for key in keys:
+        if not isinstance(key, type(u'')) and not isinstance(key, str):
+            raise ValueError("can't store the index of a document with the "
+                             "key %r" % (key,))
+    types = list(document.types)
+
+    arrays = dict((name, _new_integers()) for name in _ARRAYS)
+    arrays['parents'].extend(document.parents)
+    arrays['ends'].extend(document.ends)
+    arrays['post'].extend(document.post)
+    for node in document.nodes:
+        if node.parent_key is not None:
+            arrays['key_ids'].append(key_ids[node.parent_key])
+        else:
+            arrays['key_ids'].append(-1)
+        arrays['idxs'].append(node.idx or 0)
+        arrays['siblings'].append(node.siblings or 0)
+    for kind, names, postings in (('key', keys, document.keys),
+                                  ('type', types, document.types)):
+        offsets = arrays[kind + '_offsets']
+        offsets.append(0)
+        for name in names:
+            arrays[kind + '_postings'].extend(postings[name])
+            offsets.append(len(arrays[kind + '_postings']))
+
+    header = {'count': len(document.nodes), 'byteorder': sys.byteorder,
+              'keys': keys, 'types': types, 'arrays': {}}
+    offset = 0
+    for name in _ARRAYS:
+        header['arrays'][name] = [offset, len(arrays[name])]
+        offset += len(arrays[name]) * 8
+    header = json.dumps(header).encode('utf-8')
+    # pad the header so the arrays are aligned
+    header += b' ' * (-(_PREAMBLE.size + len(header)) % 8)
+
+    _replace(path, [_PREAMBLE.pack(_MAGIC, binascii.unhexlify(digest),
+                                   len(header)), header] +
+             [_tobytes(arrays[name]) for name in _ARRAYS])
+
+
+def read_index(path, obj, digest=None):
+    """Return a Document of obj using the index stored at path.
+
+    Returns None if there is no index at path, or it isn't one stored
+    under the hex digest given.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    if len(mapped) < _PREAMBLE.size:
+        return None
+    magic, stored, length = _PREAMBLE.unpack_from(mapped)
+    if magic != _MAGIC or (digest is not None and
+                           stored != binascii.unhexlify(digest)):
+        return None
+    start = _PREAMBLE.size + length
+    try:
+        header = json.loads(mapped[_PREAMBLE.size:start].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            return None
+        index = {}
+        for name in _ARRAYS:
+            offset, count = header['arrays'][name]
+            begin = start + offset
+            if begin + count * 8 > len(mapped):
+                return None
+            index[name] = _integers(mapped, begin, count)
+        keys, types = header['keys'], header['types']
+    except (KeyError, TypeError, ValueError):
+        # written by another version, or damaged
+        return None
+    return _StoredDocument(obj, index, keys, types)
+
+
+def load_document(fp, directory=None, decoder='auto', pause_gc=False):
+    """Read the JSON document in the file object fp and return its Document.
+
+    The index stored for a document with the same bytes is used if there
+    is one; otherwise the index is built and stored for next time.
+    pause_gc is passed on to decoders.loads.
+    Raises ValueError if the document isn't valid JSON.
+    """
+    mapped = decoders._map(fp)
+    data = decoders._read(fp) if mapped is None else mapped
+    try:
+        if mapped is not None and not hasattr(memoryview, 'release'):
+            # Python 2 can't view a mapped file
+            data = mapped[:]
+        if not isinstance(data, (bytes, mmap.mmap)):
+            data = data.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        if isinstance(data, mmap.mmap):
+            view = memoryview(data)
+            try:
+                obj = decoders.loads(view, decoder, pause_gc)
+            finally:
+                view.release()
+        else:
+            obj = decoders.loads(data, decoder, pause_gc)
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+    path = os.path.join(directory or default_directory(), digest + '.idx')
+    document = read_index(path, obj, digest)
+    if document is None:
+        document = Document(obj)
+        try:
+            write_index(document, path, digest)
+        except (IOError, OSError, ValueError):
+            # the cache is only an optimization
+            pass
+    return document
+
+
+def _grammar():
+    """A hash of the lexer's patterns, which stored tokens depend on."""
+    # hashed as written, as compiling them is what loading tokens avoids
+    patterns = [[pattern for pattern, _ in scanner.lexicon] for scanner in
+                (SCANNER, EXPR_SCANNER, ARGS_SCANNER)]
+    return hashlib.sha256(json.dumps(patterns).encode('utf-8')).hexdigest()
+
+
+def _read_selectors(path):
+    try:
+        with open(path, 'rb') as f:
+            stored = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return []
+    if not isinstance(stored, dict) or stored.get('grammar') != _grammar():
+        return []
+    return stored['tokens']
+
+
+def load_selectors(directory=None):
+    """Load the stored tokens of selectors into the lexer's cache.
+
+    Returns the number of entries loaded.
+    """
+    path = os.path.join(directory or default_directory(), _SELECTORS_FILE)
+    entries = _read_selectors(path)
+    for scanner, text, tokens in entries:
+        _lex_cache.put((_SCANNERS[scanner], text),
+                       tuple(tuple(token) for token in tokens))
+    return len(entries)
+
+
+def save_selectors(directory=None):
+    """Store the tokens of the selectors lexed so far, along with those
+    stored before, keeping the most recently used."""
+    names = dict((scanner, name) for name, scanner in _SCANNERS.items())
+    path = os.path.join(directory or default_directory(), _SELECTORS_FILE)
+    entries = collections.OrderedDict(
+        ((scanner, text), tokens)
+        for scanner, text, tokens in _read_selectors(path))
+    changed = False
+    for (scanner, text), tokens in _lex_cache.items():
+        if scanner not in names:
+            continue
+        key = (names[scanner], text)
+        changed = changed or key not in entries
+        entries.pop(key, None)
+        entries[key] = [list(token) for token in tokens]
+    if not changed:
+        return
+    while len(entries) > _MAXSELECTORS:
+        entries.popitem(last=False)
+    stored = {'grammar': _grammar(),
+              'tokens': [[scanner, text, tokens] for (scanner, text), tokens
+                         in entries.items()]}
+    _replace(path, [json.dumps(stored).encode('utf-8')])
+
+
+def clear(directory=None):
+    """Remove the stored indexes and selectors."""
+    directory = directory or default_directory()
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.idx') or name == _SELECTORS_FILE:
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,247 @@
+"""
+JSON decoders for reading documents.
+
+Public interface:
+    load
+    read a JSON document from a file object, as bytes, through mmap when
+    the file is a regular file.
+
+    loads
+    decode a JSON document from bytes, a str or a buffer.
+
+    register
+    make another decoder available by name.
+
+Decoders are chosen by name: 'json' is the standard library's, and
+'orjson', 'ujson' and 'simdjson' use those packages if they are installed.
+'auto' uses the fastest one installed. If that one rejects a document, such
+as one holding NaN, the standard library is tried instead. Documents smaller
+than 64KB are read with the standard library, unless a faster decoder has
+been imported already, as importing one takes longer than it would save.
+
+Decoding a large document allocates a great many containers, none of
+them in cycles, which sets off the cyclic garbage collector again and
+again. Passing pause_gc=True to load or loads turns the collector off
+while decoding, and back on afterwards if it was on. It is off by default,
+as it affects every thread of the process; the command line turns it on.
+
+Decoders differ at the edges: orjson, for instance, reads integers too
+large for 64 bits as floats. Use 'json' where the standard library's
+results are needed.
+"""
+import gc
+import json
+import mmap
+import os
+import stat
+
+# name -> function returning a loads function, or raising ImportError
+_factories = {}
+# name -> loads function once imported, or None if it isn't installed
+_decoders = {}
+# names of the decoders which can read buffers, such as mapped files
+_buffers = set()
+
+# decoders tried, in order, by 'auto'
+_PREFERENCE = ['orjson', 'simdjson', 'ujson', 'json']
+# documents 'auto' reads with the standard library unless another decoder
+# is imported already, in bytes
+_SMALL = 64 * 1024
+
+
+def register(name, factory, buffers=False):
+    """Make a decoder available under name.
+
+    factory is called, the first time the decoder is used, to return a
+    function decoding a document. It may raise ImportError if the decoder
+    isn't installed. If buffers is false, the function is only ever given
+    bytes or str; otherwise it may also be given a memoryview.
+    """
+    def load_factory():
+        loads = factory()
+        if buffers:
+            return loads
+        return lambda data: loads(data if isinstance(data, (bytes, str))
+                                  else bytes(data))
+    _factories[name] = load_factory
+    _decoders.pop(name, None)
+    if buffers:
+        _buffers.add(name)
+    else:
+        _buffers.discard(name)
+
+
+def _orjson():
+    import orjson
+    return orjson.loads
+
+
+def _simdjson():
+    import simdjson
+    return simdjson.loads
+
+
+def _ujson():
+    import ujson
+    return ujson.loads
+
+
+def _json():
+    return json.loads
+
+
+register('orjson', _orjson, buffers=True)
+register('simdjson', _simdjson)
+register('ujson', _ujson)
+register('json', _json)
+
+
+def available():
+    """Return the names of the decoders which are installed."""
+    names = []
+    for name in sorted(_factories):
+        try:
+            get(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def get(name='auto'):
+    """Return the function decoding documents with the decoder name.
+
+    Raises ValueError if there is no such decoder, or it isn't installed.
+    """
+    if name == 'auto':
+        name = _fastest()
+        if name != 'json':
+            return _with_fallback(get(name))
+    if name not in _decoders:
+        if name not in _factories:
+            raise ValueError("unknown decoder %s" % name)
+        try:
+            _decoders[name] = _factories[name]()
+        except ImportError:
+            _decoders[name] = None
+    if _decoders[name] is None:
+        raise ValueError("decoder %s is not installed" % name)
+    return _decoders[name]
+
+
+def _fastest():
+    """Return the name of the fastest decoder installed."""
+    for name in _PREFERENCE:
+        try:
+            get(name)
+        except ValueError:
+            continue
+        return name
+
+
+def _with_fallback(loads):
+    def loads_or_json(data):
+        try:
+            return loads(data)
+        except ValueError:
+            # faster decoders reject some documents the standard library
+            # reads, such as those holding NaN.
+            return get('json')(data)
+    return loads_or_json
+
+
+def _choose(decoder, size):
+    """Return the name of the decoder to read size bytes with, and its
+    function."""
+    if decoder != 'auto':
+        return decoder, get(decoder)
+    if size < _SMALL and not any(_decoders.get(name)
+                                 for name in _PREFERENCE[:-1]):
+        return 'json', get('json')
+    return _fastest(), get('auto')
+
+
+def loads(data, decoder='auto', pause_gc=False):
+    """Decode the JSON document data, which may be bytes, a str or any
+    object supporting the buffer protocol.
+
+    If pause_gc is true, the garbage collector is off while decoding.
+    Raises ValueError if data isn't valid JSON.
+    """
+    return _decode(_choose(decoder, len(data))[1], data, pause_gc)
+
+
+def load(fp, decoder='auto', pause_gc=False):
+    """Read and decode the JSON document in the file object fp.
+
+    fp may be opened in text or binary mode. Text mode files are read
+    through their underlying binary buffer. Regular files are mapped into
+    memory rather than read when the decoder can read buffers, so the
+    document is never copied at all.
+    If pause_gc is true, the garbage collector is off while decoding.
+    Raises ValueError if the document isn't valid JSON.
+    """
+    size = _size(fp)
+    if size is None:
+        data = _read(fp)
+        return _decode(_choose(decoder, len(data))[1], data, pause_gc)
+    decoder, loads_ = _choose(decoder, size)
+    mapped = _map(fp) if decoder in _buffers else None
+    if mapped is None:
+        return _decode(loads_, _read(fp), pause_gc)
+    view = memoryview(mapped)
+    try:
+        return _decode(loads_, view, pause_gc)
+    finally:
+        view.release()
+        mapped.close()
+
+
+def _decode(loads_, data, pause_gc):
+    if not pause_gc:
+        return loads_(data)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return loads_(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _size(fp):
+    """Return the number of bytes left in fp, or None if it isn't a regular
+    file."""
+    try:
+        info = os.fstat(fp.fileno())
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        return info.st_size - (fp.tell() if hasattr(fp, 'tell') else 0)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _map(fp):
+    """Return fp mapped into memory, or None if it can't be."""
+    try:
+        fileno = fp.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    try:
+        info = os.fstat(fileno)
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        offset = fp.tell() if hasattr(fp, 'tell') else 0
+        if not info.st_size or offset:
+            return None
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _read(fp):
+    """Read the rest of fp, as bytes if it has an underlying buffer."""
+    buffer = getattr(fp, 'buffer', None)
+    if buffer is not None:
+        return buffer.read()
+    return fp.read()
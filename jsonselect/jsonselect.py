@@ -6,26 +6,68 @@ Public interface:
     select
     take a selector and an object. return matched node(s)
 
+    iselect, select_first, exists
+    take a selector and an object. lazily yield matched values, return
+    the first match or report whether there is one, stopping the
+    traversal as soon as the answer is known.
+
+    compile
+    take a selector and return a reusable, immutable Selector.
+    compiled selectors are cached, so repeated calls are cheap.
+
+    Document
+    index an object once, for running many selectors against it.
+
+    collect_stats
+    a context manager counting what selections do and timing them.
+
+    limits
+    a context manager bounding the matches, time, nodes visited and depth
+    of selections.
+
 Exceptions:
     SelectorSyntaxError
     Raised by Parser when parsing cannot continue.
 
-TODO:
-T:expr(E)           3   A node of type T with a value that satisfies
-                        the expression E
+    LimitExceeded
+    Raised when a selection goes past a limit set with limits.
+
+Thread safety:
+    What Selectors and Documents match never changes once they are built,
+    and everything an evaluation needs to remember is kept in a _Context
+    of its own, so a single Selector or Document may be used by any number
+    of threads at once. The only state filled in by matching, the numpy
+    mask of an :expr() column, is stored once it is complete. The caches
+    behind compile and lex are locked. The objects being selected from
+    must not be modified while a selection is running.
 """
 from __future__ import division
 import re
 import numbers
 import collections
-import logging
+import contextlib
+import itertools
 import json
 import sys
+import threading
+import timeit
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 if sys.version_info[0] >= 3:
     basestring = str
 
-log = logging.getLogger(__name__)
+_scanstring = json.decoder.scanstring
+
+
+def _log():
+    # logging is slow to import and only needed on rare paths
+    import logging
+    return logging.getLogger(__name__)
+
 
 S_TYPE = lambda x, token: ('type', token)
 S_IDENTIFIER = lambda x, token: ('identifier', token[1:])
@@ -48,10 +90,68 @@ S_NUMBER = lambda x, token: ('number', token)
 S_STRING = lambda x, token: ('string', token)
 S_PAREN = lambda x, token: ('paren', token)
 
-SCANNER = re.Scanner([
-    (r"\([^\)]+\)", S_EXPR),
+class Tokenizer(object):
+
+    """
+    Splits text into tokens with a single master pattern.
+
+    lexicon is a list of (pattern, action) pairs, as for re.Scanner. The
+    patterns, none of which may match empty text, are joined into one
+    alternation, so at each position the first pattern matching wins, and
+    its action is called with the tokenizer and the matched text to make
+    the token.
+    """
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self._pattern = None
+        self.actions = dict(('t%d' % i, action)
+                            for i, (_, action) in enumerate(lexicon))
+
+    @property
+    def pattern(self):
+        """The master pattern, compiled the first time it is used."""
+        # compiling takes longer than the rest of the import, and many
+        # programs never need the expression or argument scanners.
+        if self._pattern is None:
+            self._pattern = re.compile(u'|'.join(
+                u'(?P<t%d>%s)' % (i, pattern)
+                for i, (pattern, _) in enumerate(self.lexicon)))
+        return self._pattern
+
+    def tokenize(self, string, pos=0, endpos=None):
+        """Return the tokens of string from pos up to endpos, and the
+        position at which no pattern matched."""
+        if endpos is None:
+            endpos = len(string)
+        actions = self.actions
+        tokens = []
+        for found in iter(self.pattern.scanner(string, pos, endpos).match,
+                          None):
+            tokens.append(actions[found.lastgroup](self, found.group()))
+            pos = found.end()
+        return tokens, pos
+
+
+class _LazyPattern(object):
+
+    """A regular expression compiled the first time one of its methods is
+    used, like the master patterns of a Tokenizer."""
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        value = getattr(re.compile(self.pattern, self.flags), name)
+        # kept, so later lookups don't come back here
+        setattr(self, name, value)
+        return value
+
+
+SCANNER = Tokenizer([
     (r"[~*,>]", S_OPER),
-    (r"\s", S_EMPTY),
+    (r"\s+", S_EMPTY),
     (r"(-?\d+(\.\d*)([eE][+\-]?\d+)?)", S_FLOAT),
     (r"string|boolean|null|array|object|number", S_TYPE),
     (u"\"([_a-zA-Z]|[^\0-\0177]|\\\\[^\s0-9a-fA-F])([_a-zA-Z0-9\-]"
@@ -69,196 +169,546 @@ SCANNER = re.Scanner([
 ])
 
 
-EXPR_SCANNER = re.Scanner([
-    (r"\s", S_EMPTY),
+EXPR_SCANNER = Tokenizer([
+    (r"\s+", S_EMPTY),
     (r"true|false|null", S_VALS),
     (r"-?\d+(\.\d*)?([eE][+\-]?\d+)?", S_NUMBER),
-    (r"\"([^\]|\[^\"])*\"", S_STRING),
+    (r'"([^"\\]|\\.)*"', S_STRING),
     (r"x", S_PVAR),
     (r"(&&|\|\||[\$\^<>!\*]=|[=+\-*/%<>])", S_BINOP),
     (r"\(|\)", S_PAREN)
 ])
 
+# the arguments of pclass functions. anything which is neither part of a
+# selector nor of an expression is rejected when lexing.
+ARGS_SCANNER = Tokenizer(SCANNER.lexicon + [
+    (r"-?\d+(\.\d*)?([eE][+\-]?\d+)?", S_NUMBER),
+    (r"x", S_PVAR),
+    (r"\(|\)", S_PAREN)
+])
+
+_TYPES = {
+    'string': basestring,
+    'number': numbers.Number,
+    'object': Mapping,
+    'array': list,
+    'boolean': bool,
+    'null': type(None)
+}
+
 class SelectorSyntaxError(Exception):
     pass
 
 class LexingError(SelectorSyntaxError):
     pass
 
-# metadata about a node in the target object graph
-Node = collections.namedtuple('Node', [
-    'value',
-    'parent',       # parent Node. None if root.
-    'parent_key',   # if parent is a dict, key which indexes current Node.
-    'idx',          # if parent is an array, index of curr Node. starts at 1.
-    'siblings'      # if parent is an array, number of elements in it
-])
+class LimitExceeded(Exception):
 
+    """
+    Raised when a selection goes past a limit set with jsonselect.limits.
+
+    limit is the name of the limit, such as 'max_nodes_visited', and stats
+    the Stats of the selection up to the point it was stopped.
+    """
+
+    def __init__(self, limit, value, stats):
+        Exception.__init__(self, "selection exceeded %s=%r" % (limit, value))
+        self.limit = limit
+        self.stats = stats
+
+class Node(object):
+
+    """Metadata about a node in the target object graph."""
+
+    __slots__ = (
+        'value',
+        'parent',       # parent Node. None if root.
+        'parent_key',   # if parent is a dict, key which indexes this Node.
+        'idx',          # if parent is an array, index of this Node from 1.
+        'siblings'      # if parent is an array, number of elements in it
+    )
+
+    def __init__(self, value, parent=None, parent_key=None, idx=None,
+                 siblings=None):
+        self.value = value
+        self.parent = parent
+        self.parent_key = parent_key
+        self.idx = idx
+        self.siblings = siblings
+
+    def __repr__(self):
+        return 'Node(value=%r, parent_key=%r, idx=%r, siblings=%r)' % (
+            self.value, self.parent_key, self.idx, self.siblings)
+
+    def path(self):
+        """Return the keys and array indexes, counted from 0, leading from
+        the root to this Node, as a tuple."""
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.idx is not None:
+                path.append(node.idx - 1)
+            else:
+                path.append(node.parent_key)
+            node = node.parent
+        path.reverse()
+        return tuple(path)
+
+    def pointer(self):
+        """Return the RFC 6901 JSON Pointer to this Node from the root."""
+        return _pointer(self.path())
+
+
+def _pointer(path):
+    return ''.join('/' + _escape_pointer(step) for step in path)
 
-def object_iter(obj, parent=None, parent_key=None, idx=None,
-                siblings=None):
-    """Yields each node of object graph in postorder."""
 
-    obj_node = Node(value=obj, parent=parent, parent_key=parent_key,
-                siblings=siblings, idx=idx)
+def _escape_pointer(step):
+    if not isinstance(step, basestring):
+        return str(step)
+    return step.replace('~', '~0').replace('/', '~1')
 
+
+if sys.version_info[0] >= 3:
+    _SCALARS = frozenset([type(None), bool, int, float, str])
+else:
+    _SCALARS = frozenset([type(None), bool, int, long, float, str, unicode])
+
+
+def _child_nodes(node):
+    """Yield the child Nodes of node, if it is an array or object."""
+    obj = node.value
+    if type(obj) in _SCALARS:
+        return
     if isinstance(obj, list):
-        _siblings = len(obj)
-        for i, elem in enumerate(obj):
-            for node in object_iter(elem, obj_node, None, i + 1, _siblings):
-                yield node
-    elif isinstance(obj, collections.Mapping):
+        siblings = len(obj)
+        idx = 0
+        for elem in obj:
+            idx += 1
+            yield Node(elem, node, None, idx, siblings)
+    elif isinstance(obj, Mapping):
         for key in obj:
-            for node in object_iter(obj[key], obj_node, key):
-                yield node
-    yield obj_node
+            yield Node(obj[key], node, key, None, None)
+
+
+def object_iter(obj, parent=None, parent_key=None, idx=None,
+                siblings=None):
+    """Yields each node of object graph in postorder.
+
+    The traversal keeps its own stack, so it isn't limited by the depth of
+    the recursion limit.
+    """
+
+    root = Node(obj, parent, parent_key, idx, siblings)
+    stack = [(root, _child_nodes(root))]
+    while stack:
+        for child in stack[-1][1]:
+            if type(child.value) in _SCALARS:
+                yield child
+            else:
+                stack.append((child, _child_nodes(child)))
+                break
+        else:
+            yield stack.pop()[0]
+
+
+# whitespace between a token ending one selector and a token starting
+# another is the descendant combinator.
+_ENDS_SELECTOR = ('type', 'identifier', 'pclass', 'expr')
+_STARTS_SELECTOR = ('type', 'identifier', 'pclass', 'pclass_func', 'nth_func')
+_STAR = S_OPER(None, '*')
+_DESCENDANT = S_OPER(None, ' ')
+
+
+# characters which open or close groups, or start string literals
+_GROUP_CHARS = _LazyPattern(r'["()]')
+_STRING_REST = _LazyPattern(r'(?:[^"\\]|\\.)*"', re.S)
+
+
+def _group_end(input, start):
+    """Return the index just past the parenthesized group opening at
+    start."""
+    depth = 0
+    pos = start
+    while True:
+        found = _GROUP_CHARS.search(input, pos)
+        if found is None:
+            break
+        char = found.group()
+        pos = found.end()
+        if char == '"':
+            # skip over string literals, which may contain parentheses
+            rest = _STRING_REST.match(input, pos)
+            if rest is None:
+                break
+            pos = rest.end()
+        elif char == '(':
+            depth += 1
+        else:
+            depth -= 1
+            if not depth:
+                return pos
+    raise LexingError("unbalanced parentheses at position %d of %r" % (
+        start, input))
+
 
 def lex(input, scanner=SCANNER):
-    tokens, rest = scanner.scan(input)
+    """Split input into a list of tokens.
+
+    Results are cached, so lexing the same text again is cheap.
+    Raises LexingError, giving the position of the first character which
+    can't be lexed.
+    """
+    key = (scanner, input)
+    tokens = _lex_cache.get(key)
+    if tokens is None:
+        tokens = tuple(_lex(input, scanner))
+        _lex_cache.put(key, tokens)
+    # the parser consumes the list it is given
+    return list(tokens)
+
+
+def _lex(input, scanner):
+    tokens = []
+    pos = 0
+    while True:
+        scanned, pos = scanner.tokenize(input, pos)
+        tokens.extend(scanned)
+        if input[pos:pos + 1] != '(':
+            break
+        # pclass function arguments may nest parentheses, which the
+        # scanner can't balance.
+        end = _group_end(input, pos)
+        stop = ARGS_SCANNER.tokenize(input, pos + 1, end - 1)[1]
+        if stop != end - 1:
+            raise LexingError("can't lex arguments %s: unexpected %r at "
+                              "position %d" % (input[pos:end], input[stop],
+                                               stop))
+        tokens.append(S_EXPR(None, input[pos:end]))
+        pos = end
+
+    if pos < len(input):
+        raise LexingError("unexpected %r at position %d of %r" % (
+            input[pos], pos, input))
     if not len(tokens):
         raise LexingError("no input parsed.")
-    if len(rest):
-        raise LexingError("found leftover tokens: (%s, %s)" % (tokens, rest))
-    return [tok for tok in tokens if tok[0] != 'empty']
+
+    lexed = []
+    space = False
+    for tok in tokens:
+        if tok[0] == 'empty':
+            space = True
+            continue
+        if space and lexed and (
+                (lexed[-1][0] in _ENDS_SELECTOR or lexed[-1] == _STAR) and
+                (tok[0] in _STARTS_SELECTOR or tok == _STAR)):
+            lexed.append(_DESCENDANT)
+        lexed.append(tok)
+        space = False
+    return lexed
+
+
+_VALS = {'true': True, 'false': False, 'null': None}
+
+
+def _literal(token):
+    """Return the value of a number, string or val token of lex_expr."""
+    type_, text = token
+    if type_ == 'val':
+        return _VALS[text]
+    if type_ == 'string':
+        if '\\' not in text:
+            return text[1:-1]
+        return _scanstring(text, 1)[0]
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
 
 def lex_expr(expression):
-    tokens = lex(expression, scanner=EXPR_SCANNER)
-    for i, token in enumerate(tokens):
+    tokens = []
+    for token in lex(expression, scanner=EXPR_SCANNER):
+        if token[0] == 'number' and token[1][0] == '-' and tokens and (
+                tokens[-1][0] in ('number', 'string', 'val', 'pvar') or
+                tokens[-1] == ('paren', ')')):
+            # "x-1" is a subtraction, not x followed by -1
+            tokens.append(S_BINOP(None, '-'))
+            token = (token[0], token[1][1:])
         if token[0] in ('number', 'string', 'val'):
-            tokens[i] = (token[0], json.loads(tokens[i][1]))
+            token = (token[0], _literal(token))
+        tokens.append(token)
     return tokens
 
 
+class Selector(collections.namedtuple('Selector', ['selector', 'chains',
+                                                   'program'])):
+
+    """
+    A compiled jsonselect selector.
+
+    Selectors are immutable and hold no reference to the objects they are
+    applied to, so a single Selector may be reused for any number of
+    objects. Create them with jsonselect.compile.
+    """
+
+    __slots__ = ()
+
+    def match(self, obj):
+        """Return a list of the Nodes of obj matched by this selector."""
+        return list(self._nodes(obj))
+
+    def iselect(self, obj):
+        """Yield matched values of obj, walking it only as far as needed."""
+        for node in self._nodes(obj):
+            yield node.value
+
+    def first(self, obj, default=None):
+        """Return the first matched value of obj, or default."""
+        for node in self._nodes(obj):
+            return node.value
+        return default
+
+    def exists(self, obj):
+        """Return whether this selector matches anything in obj."""
+        for node in self._nodes(obj):
+            return True
+        return False
+
+    # The following facts hold for every match, whatever the object.
+
+    @property
+    def required_keys(self):
+        """Keys found on the path from the root to every match."""
+        keys = None
+        for chain in self.chains:
+            # a step followed by '~' is a sibling of the path, not on it
+            on_path = set(simple.key for i, (_, simple) in enumerate(chain)
+                          if simple.key is not None and (
+                              i + 1 == len(chain) or chain[i + 1][0] != '~'))
+            keys = on_path if keys is None else keys & on_path
+        return frozenset(keys)
+
+    @property
+    def matches_in_arrays(self):
+        """Whether a match may be an element of an array."""
+        return any(chain[-1][1].key is None for chain in self.chains)
+
+    @property
+    def max_depth(self):
+        """The greatest depth of a match below the root, or None if
+        matches may be found at any depth."""
+        depth = 0
+        for chain in self.chains:
+            if ('pclass', 'root') not in chain[0][1].source:
+                return None
+            combinators = [combinator for combinator, _ in chain[1:]]
+            if ' ' in combinators:
+                return None
+            depth = max(depth, combinators.count('>'))
+        return depth
+
+    def _nodes(self, obj):
+        limits = _limits()
+        if limits or _collectors():
+            return _collected(self, obj, tuple(limits or ()))
+        if isinstance(obj, Document):
+            return obj.iter_match(self)
+        return _evaluate(self.program, obj)
+
+    def select(self, obj):
+        """Return matched values of obj, as jsonselect.select would."""
+        results = [node.value for node in self.match(obj)]
+        # single results should be returned as a primitive
+        if len(results) == 1:
+            return results[0]
+        elif not len(results):
+            return None
+        return results
+
+
+class SimpleSelector(collections.namedtuple('SimpleSelector', [
+        'type',         # type name the node must have, or None
+        'key',          # key the node must have in its parent, or None
+        'validators',   # predicates the node must satisfy, including the
+                        # checks for type and key
+        'tests',        # what each validator checks, as a (kind, argument)
+                        # pair such as ('type', 'number') or ('val', '("a")')
+        'source'        # the tokens it was parsed from
+        ])):
+
+    """One step of a chain of selectors, such as string.foo:first-child."""
+
+    __slots__ = ()
+
+
 class Parser(object):
 
     """
     Parse jsonselect queries.
 
     A simple top-down recursive-descendant parser of jsonselect selectors.
-    Initialize with the object you wish to match against.
+    Parser.compile accepts a selector and returns a Selector, which holds
+    the predicate functions built by the productions below.
 
-    Clients should only need to call Parser.parse, which accepts
-    a list of tokens as generated by jsonselect.lex
+    A Parser may also be initialized with an object, in which case
+    Parser.parse will apply a selector to that object.
     """
 
-    nth_child_pat = re.compile(
+    nth_child_pat = _LazyPattern(
         r"^\s*\(\s*(?:([+\-]?)([0-9]*)n\s*(?:([+\-])\s*([0-9]))?"
         r"|(odd|even)|([+\-]?[0-9]+))\s*\)"
     )
 
-    def __init__(self, obj):
-        """Create a parser for a particular object."""
+    def __init__(self, obj=None):
+        """Create a parser, optionally for a particular object."""
         self.obj = obj
 
     def parse(self, selector):
-        """Accept a list of tokens. Returns matched nodes of self.obj."""
-        log.debug(self.obj)
+        """Accept a selector string. Returns matched nodes of self.obj."""
+        _log().debug(self.obj)
+        return compile(selector).select(self.obj)
+
+    def compile(self, selector):
+        """Lex and parse selector. Returns a Selector."""
         tokens = lex(selector)
+        chains = self.selector_production(tokens)
+        return Selector(selector, chains, _Program(chains))
 
-        if self.peek(tokens, 'operator') == '*':
+    def selector_production(self, tokens):
+        """Production for a full selector: chains separated by ','.
+
+        Returns a tuple of chains, as built by chain_production.
+        """
+
+        chains = [self.chain_production(tokens)]
+        while self.peek(tokens, 'operator') == ',':
             self.match(tokens, 'operator')
-            results = list(object_iter(self.obj))
-        else:
-            results = self.selector_production(tokens)
+            chains.append(self.chain_production(tokens))
+        return tuple(chains)
 
-        results = [node.value for node in results]
-        # single results should be returned as a primitive
-        if len(results) == 1:
-            return results[0]
-        elif not len(results):
-            return None
-        return results
+    def chain_production(self, tokens):
+        """Production for simple selectors joined by combinators.
 
-    def selector_production(self, tokens):
-        """Production for a full selector."""
+        Returns a tuple of (combinator, SimpleSelector) steps, read left to
+        right. The combinator of the first step is None.
+        """
+
+        steps = [(None, self.simple_production(tokens))]
+        while len(tokens) and self.peek(tokens, 'operator') != ',':
+            if self.peek(tokens, 'operator') in ('>', '~', ' '):
+                operator = self.match(tokens, 'operator')
+            else:
+                # adjacent selectors are joined by the descendant combinator
+                operator = ' '
+            steps.append((operator, self.simple_production(tokens)))
+        return tuple(steps)
+
+    def simple_production(self, tokens):
+        """Production for a single selector, such as string.foo:first-child.
+
+        Returns a SimpleSelector.
+        """
 
         validators = []
+        tests = []
+        type_ = key = None
+        source = tuple(tokens)
         # the following productions should return predicate functions.
 
+        if self.peek(tokens, 'operator') == '*':
+            # the universal selector matches every node on its own.
+            self.match(tokens, 'operator')
+            universal = True
+        else:
+            universal = False
+
         if self.peek(tokens, 'type'):
             type_ = self.match(tokens, 'type')
             validators.append(self.type_production(type_))
+            tests.append(('type', type_))
 
         if self.peek(tokens, 'identifier'):
             key = self.match(tokens, 'identifier')
             validators.append(self.key_production(key))
+            tests.append(('key', key))
 
         if self.peek(tokens, 'pclass'):
             pclass = self.match(tokens, 'pclass')
             validators.append(self.pclass_production(pclass))
+            tests.append(('pclass', pclass))
 
         if self.peek(tokens, 'nth_func'):
             nth_func = self.match(tokens, 'nth_func')
+            tests.append((nth_func, self.peek(tokens, 'expr')))
             validators.append(self.nth_child_production(nth_func, tokens))
 
         if self.peek(tokens, 'pclass_func'):
             pclass_func = self.match(tokens, 'pclass_func')
+            tests.append((pclass_func, self.peek(tokens, 'expr')))
             validators.append(self.pclass_func_production(pclass_func, tokens))
 
-        if not len(validators):
+        if not len(validators) and not universal:
             raise SelectorSyntaxError('no selector recognized.')
 
-        # apply validators from a selector expression to self.obj
-        results = self._match_nodes(validators, self.obj)
-
-        if self.peek(tokens, 'operator'):
-            operator = self.match(tokens, 'operator')
-            rvals = self.selector_production(tokens)
-            if operator == ',':
-                results.extend(rvals)
-            elif operator == '>':
-                results = self.parents(results, rvals)
-            elif operator == '~':
-                results = self.siblings(results, rvals)
-            elif operator == ' ':
-                results = self.ancestors(results, rvals)
-            else:
-                raise SelectorSyntaxError("unrecognized operator '%s'"
-                                          % operator)
-        else:
-            if len(tokens):
-                rvals = self.selector_production(tokens)
-                results = self.ancestors(results, rvals)
+        return SimpleSelector(type_, key, tuple(validators), tuple(tests),
+                              source[:len(source) - len(tokens)])
 
-        return results
+    # The following combinators join lists of Nodes taken from the same
+    # traversal. Nodes are compared by identity, never by value.
 
-    def parents(self, lhs, rhs):
+    @staticmethod
+    def parents(lhs, rhs):
         """Find nodes in rhs which have parents in lhs."""
 
-        return [node for node in rhs if node.parent in lhs]
+        lhs_ids = set(id(node) for node in lhs)
+        return [node for node in rhs if id(node.parent) in lhs_ids]
 
-    def ancestors(self, lhs, rhs):
+    @staticmethod
+    def ancestors(lhs, rhs):
         """Return nodes from rhs which have ancestors in lhs."""
 
+        lhs_ids = set(id(node) for node in lhs)
+        # id(node) -> whether node or one of its ancestors is in lhs
+        memo = {}
+
         def _search(node):
-            if node in lhs:
-                return True
-            if not node.parent:
-                return False
-            return _search(node.parent)
+            path = []
+            found = False
+            while node is not None:
+                if id(node) in memo:
+                    found = memo[id(node)]
+                    break
+                if id(node) in lhs_ids:
+                    found = True
+                    break
+                path.append(id(node))
+                node = node.parent
+            for node_id in path:
+                memo[node_id] = found
+            return found
+
+        return [node for node in rhs if _search(node.parent)]
 
-        return [node for node in rhs if _search(node)]
+    @staticmethod
+    def siblings(lhs, rhs):
+        """Find nodes in rhs having a sibling in lhs."""
 
-    def siblings(self, lhs, rhs):
-        """Find nodes in rhs having common parents in lhs."""
-        parents = [node.parent for node in lhs]
+        lhs_ids = set(id(node) for node in lhs)
+        counts = collections.defaultdict(int)
+        for node in lhs:
+            if node.parent is not None:
+                counts[id(node.parent)] += 1
 
-        return [node for node in rhs if node.parent in parents]
+        # a node is not its own sibling
+        return [node for node in rhs if node.parent is not None and
+                counts.get(id(node.parent), 0) > (id(node) in lhs_ids)]
 
     # The following productions should return predicate functions
 
     def type_production(self, type_):
         assert type_
 
-        type_map = {
-            'string': basestring,
-            'number': numbers.Number,
-            'object': collections.Mapping,
-            'array': list,
-            'boolean': bool,
-            'null': type(None)
-        }
-        return lambda node: isinstance(node.value, type_map[type_])
+        return lambda node: isinstance(node.value, _TYPES[type_])
 
     def key_production(self, key):
         assert key
@@ -285,75 +735,67 @@ class Parser(object):
         except KeyError:
             raise SelectorSyntaxError("unrecognized pclass %s" % pclass)
 
-    def parse_expr(self, tokens, node):
-        def types_eq(type_, *args):
-            return all([isinstance(arg, type_) for arg in args])
-
-        cmpf_map = {
-            '*': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                   lhs * rhs),
-            '/': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                   lhs / rhs),
-            '%': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                   lhs % rhs),
-            '+': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                   lhs + rhs),
-            '-': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                   lhs - rhs),
-            '<=': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                    lhs <= rhs),
-            '<': lambda lhs, rhs: (types_eq(basestring, lhs, rhs) and
-                                   lhs < rhs),
-            '>=': lambda lhs, rhs: (types_eq(numbers.Number, lhs, rhs) and
-                                    lhs >= rhs),
-            '>': lambda lhs, rhs: (types_eq(basestring, lhs, rhs) and
-                                   lhs > rhs),
-            '$=': lambda lhs, rhs: (types_eq(basestring, lhs, rhs) and
-                                    lhs.rfind(rhs) == len(lhs) - len(rhs)),
-            '^=': lambda lhs, rhs: (types_eq(basestring, lhs, rhs) and
-                                    lhs.find(rhs) == 0),
-            '*=': lambda lhs, rhs: (types_eq(basestring, lhs, rhs) and
-                                    lhs.find(rhs) != 0),
-            '=': lambda lhs, rhs: lhs == rhs,
-            '!=': lambda lhs, rhs: lhs != rhs,
-            '&&': lambda lhs, rhs: lhs and rhs,
-            '||': lambda lhs, rhs: lhs or rhs
-        }
-
-# ((12 % 10) + 40 = x)
-
-        def parse(tokens):
-            if not len(tokens):
-                raise Exception
-
-            if self.peek(tokens, 'paren') == '(':
-                self.match(tokens, 'paren')
-                lhs = parse(tokens)
-                return lhs
-            elif self.peek(tokens, 'pvar') is not None:
-                self.match(tokens, 'pvar')
-                lhs = node.value
-            else:
-                for tok in ('string', 'val', 'number'):
-                    if self.peek(tokens, tok) is not None:
-                        lhs = self.match(tokens, tok)
-                        break
-
-            if self.peek(tokens, 'paren') == ')':
-                self.match(tokens, 'paren')
-                return lhs
-
-            op = self.match(tokens, 'binop')
-            cf = cmpf_map[op]
-            rhs = parse(tokens)
-
-            return cf(lhs, rhs)
-
-        return parse(tokens)
+    # binding power of :expr() operators, as in jsonselect.js
+    expr_precedence = {
+        '*': 9, '/': 9, '%': 9,
+        '+': 7, '-': 7,
+        '<=': 5, '<': 5, '>=': 5, '>': 5, '$=': 5, '^=': 5, '*=': 5,
+        '=': 3, '!=': 3,
+        '&&': 2,
+        '||': 1
+    }
+
+    def parse_expr(self, tokens):
+        """Parse tokens from lex_expr into an expression tree.
+
+        The tree is made of ('x',), ('literal', value) and
+        (operator, lhs, rhs) tuples.
+        """
+        tree, pos = self._expr(tokens, 0, 0)
+        if pos != len(tokens):
+            raise SelectorSyntaxError("unexpected token in expression: %s"
+                                      % (tokens[pos],))
+        return tree
+
+    def _expr(self, tokens, pos, min_precedence):
+        """Precedence climbing over binary, left associative operators."""
+        lhs, pos = self._expr_operand(tokens, pos)
+        while pos < len(tokens) and tokens[pos][0] == 'binop':
+            op = tokens[pos][1]
+            precedence = self.expr_precedence[op]
+            if precedence < min_precedence:
+                break
+            rhs, pos = self._expr(tokens, pos + 1, precedence + 1)
+            lhs = (op, lhs, rhs)
+        return lhs, pos
+
+    def _expr_operand(self, tokens, pos):
+        if pos >= len(tokens):
+            raise SelectorSyntaxError("expression ended unexpectedly")
+
+        type_, value = tokens[pos]
+        if type_ == 'paren' and value == '(':
+            tree, pos = self._expr(tokens, pos + 1, 0)
+            if pos >= len(tokens) or tokens[pos] != ('paren', ')'):
+                raise SelectorSyntaxError("unbalanced parentheses in "
+                                          "expression")
+            return tree, pos + 1
+        elif type_ == 'pvar':
+            return ('x',), pos + 1
+        elif type_ in ('string', 'val', 'number'):
+            return ('literal', value), pos + 1
+        raise SelectorSyntaxError("unexpected token in expression: %s"
+                                  % (tokens[pos],))
 
     def expr_production(self, args):
-        tokens = lex_expr(args)
-        return lambda node: self.parse_expr(list(tokens), node)
+        tree = self.parse_expr(lex_expr(args))
+        evaluate = _compile_expr(tree)
+
+        if not _expr_uses_x(tree):
+            # constant expressions are evaluated once
+            result = evaluate(None)
+            return lambda node: result
+        return lambda node: evaluate(node.value)
 
     def pclass_func_production(self, pclass, tokens):
         args = self.match(tokens, 'expr')
@@ -365,13 +807,9 @@ class Parser(object):
 
         if pclass == 'has':
             # T:has(S)
-            # A node of type T which has a child node satisfying the selector S
-            for i, token in enumerate(args):
-                if token[1] == '>':
-                    args[i] = (token[0], ' ')
-            rvals = self.selector_production(args)
-            ancestors = [node.parent for node in rvals]
-            return lambda node: node in ancestors
+            # A node of type T which has a descendant node satisfying the
+            # selector S, applied to the subtree rooted at that node.
+            return _Has(_Program(self.selector_production(args)))
 
         if pclass == 'contains':
             return lambda node: (isinstance(node.value, basestring) and
@@ -409,7 +847,7 @@ class Parser(object):
         def validate(node):
             """This crazy function taken from jsonselect.js:444."""
 
-            if not node.siblings:
+            if node.idx is None:
                 return False
 
             idx = node.idx - 1
@@ -429,18 +867,6 @@ class Parser(object):
 
         return validate
 
-    def _match_nodes(self, validators, obj):
-        """Apply each validator in validators to each node in obj.
-
-        Return each node in obj which matches all validators.
-        """
-
-        results = []
-        for node in object_iter(obj):
-            if all([validate(node) for validate in validators]):
-                results.append(node)
-        return results
-
     @staticmethod
     def match(tokens, type_):
         if Parser.peek(tokens, type_) is None:
@@ -462,16 +888,1380 @@ class Parser(object):
             return None
 
 
+def _is_number(value):
+    return isinstance(value, numbers.Number)
+
+
+def _is_string(value):
+    return isinstance(value, basestring)
+
+
+_EXPR_OPERATORS = {
+    '*': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                           lhs * rhs),
+    '/': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                           lhs / rhs),
+    '%': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                           lhs % rhs),
+    '+': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                           lhs + rhs),
+    '-': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                           lhs - rhs),
+    '<=': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                            lhs <= rhs),
+    '<': lambda lhs, rhs: (_is_string(lhs) and _is_string(rhs) and
+                           lhs < rhs),
+    '>=': lambda lhs, rhs: (_is_number(lhs) and _is_number(rhs) and
+                            lhs >= rhs),
+    '>': lambda lhs, rhs: (_is_string(lhs) and _is_string(rhs) and
+                           lhs > rhs),
+    '$=': lambda lhs, rhs: (_is_string(lhs) and _is_string(rhs) and
+                            lhs.rfind(rhs) == len(lhs) - len(rhs)),
+    '^=': lambda lhs, rhs: (_is_string(lhs) and _is_string(rhs) and
+                            lhs.find(rhs) == 0),
+    '*=': lambda lhs, rhs: (_is_string(lhs) and _is_string(rhs) and
+                            lhs.find(rhs) != 0),
+    '=': lambda lhs, rhs: lhs == rhs,
+    '!=': lambda lhs, rhs: lhs != rhs,
+}
+
+
+def _expr_uses_x(tree):
+    if tree[0] == 'x':
+        return True
+    if tree[0] == 'literal':
+        return False
+    return _expr_uses_x(tree[1]) or _expr_uses_x(tree[2])
+
+
+def _compile_expr(tree):
+    """Turn an expression tree into a function of the value of x."""
+    if tree[0] == 'x':
+        return lambda x: x
+    if tree[0] == 'literal':
+        value = tree[1]
+        return lambda x: value
+
+    op, lhs, rhs = tree
+    if op == '&&':
+        lhs, rhs = _compile_expr(lhs), _compile_expr(rhs)
+        return lambda x: lhs(x) and rhs(x)
+    if op == '||':
+        lhs, rhs = _compile_expr(lhs), _compile_expr(rhs)
+        return lambda x: lhs(x) or rhs(x)
+
+    func = _EXPR_OPERATORS[op]
+    # comparing x against a literal is by far the most common shape
+    if lhs == ('x',) and rhs[0] == 'literal':
+        value = rhs[1]
+        return lambda x: func(x, value)
+    if lhs[0] == 'literal' and rhs == ('x',):
+        value = lhs[1]
+        return lambda x: func(value, x)
+    lhs, rhs = _compile_expr(lhs), _compile_expr(rhs)
+    return lambda x: func(lhs(x), rhs(x))
+
+
+# arrays with at least this many elements have their children tested a
+# column at a time.
+_BATCH_SIZE = 16
+
+# numpy, once imported. False if it isn't installed.
+_numpy = None
+
+
+def _import_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+class _Column(object):
+
+    """The elements of an array, tested together."""
+
+    __slots__ = ('values', '_numbers')
+
+    def __init__(self, values):
+        self.values = values
+        self._numbers = None
+
+    @property
+    def numbers(self):
+        """The elements as a numpy array, or False if they aren't all
+        numbers numpy holds exactly, or numpy isn't installed."""
+        if self._numbers is None:
+            self._numbers = False
+            numpy = _import_numpy()
+            if numpy:
+                try:
+                    numbers = numpy.array(self.values)
+                except (ValueError, TypeError):
+                    numbers = None
+                # beyond 2 ** 53, floats can't tell integers apart
+                if (numbers is not None and numbers.ndim == 1 and
+                        numbers.dtype.kind in 'if' and len(numbers) and
+                        numpy.abs(numbers).max() < 2 ** 53):
+                    self._numbers = numbers
+        return self._numbers
+
+
+_NUMPY_COMPARISONS = {
+    '<=': lambda lhs, rhs: lhs <= rhs,
+    '>=': lambda lhs, rhs: lhs >= rhs,
+    '=': lambda lhs, rhs: lhs == rhs,
+    '!=': lambda lhs, rhs: lhs != rhs,
+}
+
+
+def _is_numeric_literal(tree):
+    return (tree[0] == 'literal' and _is_number(tree[1]) and
+            not isinstance(tree[1], bool))
+
+
+def _numpy_mask(tree):
+    """Turn an expression tree into a function of an array of numbers,
+    returning where the expression holds. Returns None for expressions
+    other than comparisons of x with numbers, joined by && and ||."""
+    op = tree[0]
+    if op in ('&&', '||'):
+        lhs, rhs = _numpy_mask(tree[1]), _numpy_mask(tree[2])
+        if lhs is None or rhs is None:
+            return None
+        if op == '&&':
+            return lambda x: _numpy.logical_and(lhs(x), rhs(x))
+        return lambda x: _numpy.logical_or(lhs(x), rhs(x))
+
+    if op not in _NUMPY_COMPARISONS:
+        return None
+    compare = _NUMPY_COMPARISONS[op]
+    lhs, rhs = tree[1], tree[2]
+    if lhs == ('x',) and _is_numeric_literal(rhs):
+        value = rhs[1]
+        return lambda x: compare(x, value)
+    if rhs == ('x',) and _is_numeric_literal(lhs):
+        value = lhs[1]
+        return lambda x: compare(value, x)
+    return None
+
+
+class _ExprColumn(object):
+
+    """Filters a column by :expr(), with numpy when it can."""
+
+    __slots__ = ('validate', 'args', '_mask')
+
+    def __init__(self, validate, args):
+        self.validate = validate
+        self.args = args
+        self._mask = None
+
+    def __call__(self, column, candidates, probe, context):
+        mask = self._mask
+        if mask is None:
+            # built before it is stored, as other threads may be reading it
+            mask = False
+            if _import_numpy():
+                tree = Parser().parse_expr(lex_expr(self.args))
+                mask = _numpy_mask(tree) or False
+            self._mask = mask
+        if mask and column.numbers is not False:
+            hits = mask(column.numbers).tolist()
+            return [i for i in candidates if hits[i]]
+        return _probe_column(self.validate)(column, candidates, probe,
+                                            context)
+
+
+def _probe_column(validate):
+    """Filter a column by a validator, run on a single reused Node."""
+    def column_filter(column, candidates, probe, context):
+        values = column.values
+        hits = []
+        for i in candidates:
+            probe.value = values[i]
+            probe.idx = i + 1
+            if validate(probe):
+                hits.append(i)
+        return hits
+    return column_filter
+
+
+def _type_column(type_):
+    def column_filter(column, candidates, probe, context):
+        values = column.values
+        return [i for i in candidates if isinstance(values[i], type_)]
+    return column_filter
+
+
+def _no_column(column, candidates, probe, context):
+    return []
+
+
+def _has_column(has):
+    def column_filter(column, candidates, probe, context):
+        values = column.values
+        hits = []
+        for i in candidates:
+            probe.value = values[i]
+            probe.idx = i + 1
+            if has.check(probe, context):
+                hits.append(i)
+        return hits
+    return column_filter
+
+
+def _column_filters(simple):
+    """Return functions filtering array elements by each test of simple.
+
+    Each takes a _Column, the indices of the elements still matching, a
+    Node to test elements with and the evaluation context, and returns the
+    indices of the elements passing its test. :has() comes last, as it
+    does for single nodes.
+    """
+    filters = []
+    has = []
+    for (kind, arg), validate in zip(simple.tests, simple.validators):
+        if kind == 'type':
+            filters.append(_type_column(_TYPES[arg]))
+        elif kind == 'key' or (kind == 'pclass' and arg == 'root'):
+            # array elements have no key, and are never the root
+            filters.append(_no_column)
+        elif kind == 'expr':
+            filters.append(_ExprColumn(validate, arg))
+        elif kind == 'has':
+            has.append(_has_column(validate))
+        else:
+            filters.append(_probe_column(validate))
+    return filters + has
+
+
+class _Program(object):
+
+    """
+    The steps of a list of chains, flattened for evaluation.
+
+    Every step of every chain is a state, numbered in order, so the state
+    following state s in its chain is s + 1. For each state we keep its
+    validators and the combinator joining it to the next state, or None
+    if it ends its chain. :has() validators are kept apart, since they
+    need the evaluation context and are the most expensive to run.
+    """
+
+    __slots__ = ('simples', 'validators', 'has', 'next', 'successor',
+                 'heads', 'sibling_states', 'keys', 'keyed', 'anchored',
+                 'floating', 'columns', 'types', 'plain')
+
+    def __init__(self, chains):
+        simples = []
+        validators = []
+        has = []
+        next_ = []
+        heads = []
+        for chain in chains:
+            heads.append(len(validators))
+            for i, (combinator, simple) in enumerate(chain):
+                simples.append(simple)
+                validators.append(tuple(v for v in simple.validators
+                                        if not isinstance(v, _Has)))
+                has.append(tuple(v for v in simple.validators
+                                 if isinstance(v, _Has)))
+                if i + 1 < len(chain):
+                    next_.append(chain[i + 1][0])
+                else:
+                    next_.append(None)
+        self.simples = tuple(simples)
+        self.validators = tuple(validators)
+        self.has = tuple(has)
+        self.next = tuple(next_)
+        self.successor = tuple(frozenset((s + 1,))
+                               for s in range(len(next_)))
+        self.heads = frozenset(heads)
+        self.sibling_states = frozenset(s for s, combinator in
+                                        enumerate(next_) if combinator == '~')
+        self.keys = tuple(simple.key for simple in simples)
+        # states which can only match nodes with a given key, so never
+        # array elements or the root.
+        self.keyed = frozenset(s for s, key in enumerate(self.keys)
+                               if key is not None)
+        # heads which can only match the root need not be passed down.
+        self.anchored = frozenset(s for s in self.heads
+                                  if ('pclass', 'root') in simples[s].source)
+        self.floating = self.heads - self.anchored
+        self.columns = tuple(_column_filters(simple) for simple in simples)
+        self.types = tuple(_TYPES.get(simple.type) for simple in simples)
+        # programs testing nothing but keys and types, without the sibling
+        # combinator, are run by _visit_plain.
+        self.plain = not self.sibling_states and all(
+            kind in ('type', 'key') for simple in simples
+            for kind, _ in simple.tests)
+
+    def test_column(self, state, column, probe, context):
+        """Return the indices of the elements of column matching state."""
+        candidates = range(len(column.values))
+        for column_filter in self.columns[state]:
+            candidates = column_filter(column, candidates, probe, context)
+            if not candidates:
+                break
+        return candidates
+
+    def test(self, state, node, context):
+        for validate in self.validators[state]:
+            if not validate(node):
+                return False
+        for has in self.has[state]:
+            if not has.check(node, context):
+                return False
+        return True
+
+
+class _Context(object):
+
+    """State kept for a single evaluation of a compiled selector."""
+
+    __slots__ = ('has_cache', 'stats', 'limits', 'checked_at', 'max_depth')
+
+    def __init__(self, stats=None, limits=()):
+        # (id(_Has), id(container)) -> result of the :has() check
+        self.has_cache = {}
+        # the Stats being collected for the evaluation, if any. limits
+        # are only enforced when it is.
+        self.stats = stats
+        # the Limits in force, and the count of nodes visited after which
+        # they are next checked
+        self.limits = limits
+        self.checked_at = 0 if limits else float('inf')
+        depths = [bounds.max_depth for bounds in limits
+                  if bounds.max_depth is not None]
+        self.max_depth = min(depths) if depths else None
+
+    def visit(self, count):
+        """Count nodes visited, checking the limits in force."""
+        stats = self.stats
+        stats.nodes_visited += count
+        if stats.nodes_visited > self.checked_at:
+            # the clock is read once every _CLOCK_NODES nodes at most
+            checked_at = stats.nodes_visited + _CLOCK_NODES
+            for limits in self.limits:
+                checked_at = min(checked_at, limits.check(stats))
+            self.checked_at = checked_at
+
+    def too_deep(self, depth):
+        """Raise LimitExceeded if depth is greater than max_depth."""
+        if self.max_depth is not None and depth > self.max_depth:
+            raise LimitExceeded('max_depth', self.max_depth, self.stats)
+
+
+class _Has(object):
+
+    """
+    Predicate for T:has(S).
+
+    S is applied to the subtree rooted at the candidate node, which is the
+    root of that subtree for the purposes of S, and the candidate matches
+    if S matches any node below it. The result depends only on the value
+    of the candidate, so it is cached per container for the evaluation.
+    """
+
+    __slots__ = ('program', 'simple')
+
+    def __init__(self, program):
+        self.program = program
+        # without combinators, whether a node below the candidate matches
+        # S does not depend on where the subtree is rooted, so one pass
+        # over the document answers the check for every container in it.
+        self.simple = not any(program.next)
+
+    def __call__(self, node):
+        return self.check(node, _Context())
+
+    def check(self, node, context):
+        value = node.value
+        if not isinstance(value, (list, Mapping)):
+            return False
+
+        key = (id(self), id(value))
+        try:
+            return context.has_cache[key]
+        except KeyError:
+            pass
+
+        if self.simple:
+            result = self._contains(node, context)
+        else:
+            root = Node(value, None, None, None, None)
+            result = False
+            for hit in _visit(self.program, root, self.program.heads,
+                              _EMPTY, context):
+                if hit is not root:
+                    result = True
+                    break
+        context.has_cache[key] = result
+        return result
+
+    def _contains(self, node, context):
+        """Whether a node below node matches S, when S has no combinators.
+
+        Walks the subtree depth first, stopping at the first hit and
+        recording the result for every container it walks into.
+        """
+        program = self.program
+        cache = context.has_cache
+        path = [node]
+        stack = [_child_nodes(node)]
+        while stack:
+            for child in stack[-1]:
+                if context.stats is not None:
+                    context.visit(1)
+                hit = False
+                for state in program.heads:
+                    if program.test(state, child, context):
+                        hit = True
+                        break
+                if not hit and type(child.value) not in _SCALARS:
+                    hit = cache.get((id(self), id(child.value)))
+                    if hit is None:
+                        path.append(child)
+                        if context.max_depth is not None:
+                            context.too_deep(len(path) - 1)
+                        stack.append(_child_nodes(child))
+                        break
+                if hit:
+                    # every container on the path contains this hit
+                    for container in path:
+                        cache[(id(self), id(container.value))] = True
+                    return True
+            else:
+                stack.pop()
+                cache[(id(self), id(path.pop().value))] = False
+        return False
+
+
+_EMPTY = frozenset()
+
+
+class _CountingProgram(_Program):
+
+    """
+    A copy of a _Program which counts, in a Stats, every validator it runs
+    and every state it passes on.
+
+    It never runs as a plain program or tests arrays with numpy, so that
+    each test is made, and counted, on its own.
+    """
+
+    __slots__ = ('stats', 'checks')
+
+    def __init__(self, program, stats):
+        for name in _Program.__slots__:
+            setattr(self, name, getattr(program, name))
+        self.stats = stats
+        self.plain = False
+        # (kind, validator) pairs of each state, :has() apart as before
+        self.checks = tuple(
+            tuple((kind, validate) for (kind, _), validate in
+                  zip(simple.tests, simple.validators)
+                  if not isinstance(validate, _Has))
+            for simple in self.simples)
+        self.has = tuple(tuple(_Has(_CountingProgram(has.program, stats))
+                               for has in state_has)
+                         for state_has in self.has)
+
+    def test_column(self, state, column, probe, context):
+        hits = []
+        for i, value in enumerate(column.values):
+            probe.value = value
+            probe.idx = i + 1
+            if self.test(state, probe, context):
+                hits.append(i)
+        return hits
+
+    def test(self, state, node, context):
+        calls = self.stats.calls
+        for kind, validate in self.checks[state]:
+            calls[kind] = calls.get(kind, 0) + 1
+            if not validate(node):
+                return False
+        for has in self.has[state]:
+            calls['has'] = calls.get('has', 0) + 1
+            if not has.check(node, context):
+                return False
+        combinator = self.next[state]
+        if combinator is not None:
+            passed = self.stats.passed
+            passed[combinator] = passed.get(combinator, 0) + 1
+        return True
+
+
+def _sibling_states(program, children, inherited, context):
+    """Find the states each child gains through the sibling combinator.
+
+    inherited is the set of states every child is tested against. A child
+    matching state s, where s is followed by '~', passes s + 1 on to all of
+    its siblings, which may in turn match and pass on states of their own.
+    Returns a list holding a set of gained states for each child.
+    """
+    gained = [_EMPTY] * len(children)
+    while True:
+        sources = []
+        counts = collections.defaultdict(int)
+        for i, child in enumerate(children):
+            candidates = (inherited | gained[i]) & program.sibling_states
+            matched = set(s + 1 for s in candidates
+                          if program.test(s, child, context))
+            sources.append(matched)
+            for s in matched:
+                counts[s] += 1
+        # a state is gained from any sibling matching it, other than
+        # the child itself.
+        updated = [frozenset(s for s, count in counts.items()
+                             if count > (s in sources[i]))
+                   for i in range(len(children))]
+        if updated == gained:
+            return gained
+        gained = updated
+
+
+def _evaluate(program, obj):
+    """Yield the Nodes of obj matched by program, in postorder.
+
+    obj is traversed once. Each node is tested against the states passed
+    down the path leading to it: states inherited by every descendant of
+    an ancestor (the descendant combinator), and states given only to it
+    by its parent (the child combinator) or its siblings.
+    """
+    if program.plain:
+        return _visit_plain(program, obj)
+    return _visit(program, Node(obj, None, None, None, None),
+                  program.floating, program.anchored, _Context())
+
+
+def _step(program, node, inherited, given, context):
+    """Test node against the states passed down to it.
+
+    Returns a tuple of whether node ends a chain, the states to pass to all
+    of its descendants and the states to pass only to its children.
+    """
+    matched = False
+    descendants = inherited
+    children_only = _EMPTY
+    if context.stats is not None:
+        context.visit(1)
+
+    for state in (inherited | given if given else inherited):
+        if not program.test(state, node, context):
+            continue
+        combinator = program.next[state]
+        if combinator is None:
+            matched = True
+        elif combinator == ' ':
+            descendants = descendants | program.successor[state]
+        elif combinator == '>':
+            children_only = children_only | program.successor[state]
+    return matched, descendants, children_only
+
+
+def _wanted_children(node, keys, containers):
+    """Yield the child Nodes of node which have one of keys, and if
+    containers is true those which are arrays or objects."""
+    obj = node.value
+    if isinstance(obj, list):
+        if not containers:
+            return
+        siblings = len(obj)
+        idx = 0
+        for elem in obj:
+            idx += 1
+            if type(elem) not in _SCALARS:
+                yield Node(elem, node, None, idx, siblings)
+    elif isinstance(obj, Mapping):
+        if not containers and len(keys) == 1:
+            # look the key up rather than scanning a wide object
+            for key in keys:
+                if key in obj:
+                    yield Node(obj[key], node, key, None, None)
+            return
+        for key in obj:
+            value = obj[key]
+            if key in keys or type(value) not in _SCALARS:
+                yield Node(value, node, key, None, None)
+
+
+def _child_steps(program, node, descendants, children_only, context):
+    """Yield (child, matched, descendants, children_only) for each child
+    of node, as _step finds them.
+
+    Children which can neither match a state nor pass states on to their
+    descendants are skipped, along with their subtrees.
+    """
+    pending = descendants | children_only
+    gained = None
+    if program.sibling_states and pending & program.sibling_states:
+        children = list(_child_nodes(node))
+        gained = _sibling_states(program, children, pending, context)
+    elif pending <= program.keyed:
+        # only children with one of the keys wanted can match. the others
+        # are worth visiting only if they are containers with descendants
+        # to test.
+        children = _wanted_children(node, set(program.keys[s]
+                                              for s in pending),
+                                    bool(descendants))
+    elif type(node.value) is list and len(node.value) >= _BATCH_SIZE:
+        for step in _batched_steps(program, node, pending, descendants,
+                                   children_only, context):
+            yield step
+        return
+    else:
+        children = _child_nodes(node)
+
+    for i, child in enumerate(children):
+        # states given to this child alone, by its parent and siblings
+        given = children_only | gained[i] if gained else children_only
+        matched, child_descendants, grandchildren_only = _step(
+            program, child, descendants, given, context)
+        yield child, matched, child_descendants, grandchildren_only
+
+
+def _batched_steps(program, node, pending, descendants, children_only,
+                   context):
+    """Step through the children of an array a column at a time.
+
+    Each pending state is tested against all the elements at once, one
+    predicate after another, each only on the elements which passed the
+    ones before. Scalars matching no state are skipped without ever being
+    made into Nodes.
+    """
+    values = node.value
+    siblings = len(values)
+    column = _Column(values)
+    probe = Node(None, node, None, None, siblings)
+    if context.stats is not None:
+        context.visit(siblings)
+
+    matched = set()
+    # index -> states matched by the element which pass on successors
+    passing = collections.defaultdict(list)
+    for state in pending:
+        hits = program.test_column(state, column, probe, context)
+        if program.next[state] is None:
+            matched.update(hits)
+        else:
+            for i in hits:
+                passing[i].append(state)
+
+    for i, value in enumerate(values):
+        if type(value) in _SCALARS:
+            if i in matched:
+                yield (Node(value, node, None, i + 1, siblings), True,
+                       _EMPTY, _EMPTY)
+            continue
+        child_descendants = descendants
+        grandchildren_only = _EMPTY
+        for state in passing.get(i, ()):
+            if program.next[state] == ' ':
+                child_descendants = (child_descendants |
+                                     program.successor[state])
+            else:
+                grandchildren_only = (grandchildren_only |
+                                      program.successor[state])
+        yield (Node(value, node, None, i + 1, siblings), i in matched,
+               child_descendants, grandchildren_only)
+
+
+def _visit(program, node, inherited, given, context):
+    """Yield the nodes from node down matched by program, in postorder.
+
+    Containers waiting for their children to be visited are kept on an
+    explicit stack, so deeply nested documents don't exhaust the recursion
+    limit, and scalars are tested without being pushed at all.
+    """
+    matched, descendants, children_only = _step(program, node, inherited,
+                                                given, context)
+    stack = [(node, matched, _child_steps(program, node, descendants,
+                                          children_only, context))]
+    limit_depth = context.max_depth is not None
+
+    while stack:
+        frame = stack[-1]
+        for child, matched, descendants, children_only in frame[2]:
+            if type(child.value) not in _SCALARS:
+                stack.append((child, matched, _child_steps(
+                    program, child, descendants, children_only, context)))
+                if limit_depth:
+                    context.too_deep(len(stack) - 1)
+                break
+            if matched:
+                yield child
+        else:
+            stack.pop()
+            if frame[1]:
+                yield frame[0]
+
+
+def _visit_plain(program, obj):
+    """Yield the Nodes of obj matched by a plain program, in postorder.
+
+    Plain programs test nothing but keys and types, so the states passed
+    down to a node fit in the bits of an int, which are tested inline.
+    The traversal runs over the values themselves: Nodes are only made
+    for matches and the containers on the path to them.
+    """
+    types = program.types
+    next_ = program.next
+    heads = 0
+    for state in program.heads:
+        heads |= 1 << state
+    # the states a node may match, by its key
+    by_key = {}
+    unkeyed = 0
+    for state, key in enumerate(program.keys):
+        if key is None:
+            unkeyed |= 1 << state
+        else:
+            by_key[key] = by_key.get(key, 0) | 1 << state
+
+    def step(value, candidates):
+        """Return whether value ends a chain, and the states it passes
+        to its descendants and to its children."""
+        matched = False
+        descendants = children = 0
+        state = 0
+        while candidates:
+            if candidates & 1 and (types[state] is None or
+                                   isinstance(value, types[state])):
+                combinator = next_[state]
+                if combinator is None:
+                    matched = True
+                elif combinator == '>':
+                    children |= 2 << state
+                else:
+                    descendants |= 2 << state
+            candidates >>= 1
+            state += 1
+        return matched, descendants, children
+
+    # a frame is a list of the container's value, key, idx and siblings,
+    # whether it matched, the states for its descendants and children, an
+    # iterator over its children, and its Node once one is needed.
+    def frame(value, key, idx, siblings, matched, descendants, children):
+        if isinstance(value, list):
+            items = enumerate(value, 1)
+        elif type(value) is dict:
+            items = iter(value.items())
+        elif isinstance(value, Mapping):
+            items = ((key, value[key]) for key in value)
+        else:
+            items = iter(())
+        return [value, key, idx, siblings, matched, descendants, children,
+                items, None]
+
+    def path_node(stack):
+        """Return the Node of the innermost container, making Nodes for
+        the containers on the path which don't have one yet."""
+        i = len(stack) - 1
+        while stack[i][8] is None:
+            i -= 1
+        node = stack[i][8]
+        for outer in stack[i + 1:]:
+            node = outer[8] = Node(outer[0], node, outer[1], outer[2],
+                                   outer[3])
+        return node
+
+    matched, descendants, children = step(obj, heads & unkeyed)
+    root = frame(obj, None, None, None, matched, heads | descendants,
+                 children)
+    root[8] = Node(obj, None, None, None, None)
+    stack = [root]
+    while stack:
+        top = stack[-1]
+        container = top[0]
+        inherited = top[5]
+        pending = inherited | top[6]
+        if isinstance(container, list):
+            siblings = len(container)
+        else:
+            siblings = None
+
+        for k, value in top[7]:
+            if siblings is None:
+                key, idx = k, None
+            else:
+                key, idx = None, k
+            candidates = pending & (unkeyed | by_key.get(key, 0)
+                                    if key is not None else unkeyed)
+            if candidates:
+                matched, descendants, children = step(value, candidates)
+            else:
+                matched = False
+                descendants = children = 0
+            if type(value) in _SCALARS:
+                if matched:
+                    yield Node(value, top[8] or path_node(stack), key, idx,
+                               siblings)
+                continue
+            descendants |= inherited
+            if descendants or children:
+                stack.append(frame(value, key, idx, siblings, matched,
+                                   descendants, children))
+                break
+            if matched:
+                yield Node(value, top[8] or path_node(stack), key, idx,
+                           siblings)
+        else:
+            if top[4]:
+                node = path_node(stack)
+                stack.pop()
+                yield node
+            else:
+                stack.pop()
+
+
+def _type_name(value):
+    """Return the JSON type name of value, as used by type selectors."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, basestring):
+        return 'string'
+    if isinstance(value, numbers.Number):
+        return 'number'
+    if isinstance(value, list):
+        return 'array'
+    if isinstance(value, Mapping):
+        return 'object'
+    return None
+
+
+class Document(object):
+
+    """
+    An object indexed for running many selectors against it.
+
+    The index is built by a single traversal and holds, for every node in
+    document order, its Node, the position of its parent, the position of
+    the last node of its subtree and its position in postorder. Nodes are
+    also listed by key and by type, so selectors look up the candidates for
+    each step instead of walking the whole object.
+
+    Documents may be passed anywhere an object is selected from. The
+    object must not be modified while it is indexed.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.nodes = []     # Nodes in document order
+        self.parents = []   # position of each node's parent, -1 for the root
+        self.ends = []      # position of the last node in each subtree
+        self.post = []      # position of each node in postorder
+        self.keys = {}      # key -> positions of nodes with that parent_key
+        self.types = {}     # type name -> positions of nodes of that type
+
+        nodes = self.nodes
+        parents = self.parents
+        ends = self.ends
+        post = self.post
+        keys = self.keys
+        types = self.types
+        count = 0
+
+        stack = [(Node(obj), -1, None)]
+        while stack:
+            node, parent, children = stack.pop()
+            if children is not None:
+                # every node below position parent has been visited
+                ends[parent] = len(nodes) - 1
+                post[parent] = count
+                count += 1
+                continue
+
+            pos = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            ends.append(pos)
+            post.append(None)
+            if node.parent_key is not None:
+                keys.setdefault(node.parent_key, []).append(pos)
+            types.setdefault(_type_name(node.value), []).append(pos)
+
+            children = list(_child_nodes(node))
+            stack.append((node, pos, children))
+            for child in reversed(children):
+                stack.append((child, pos, None))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def match(self, selector):
+        """Return a list of the Nodes matched by selector."""
+        return list(self.iter_match(compile(selector)))
+
+    def select(self, selector):
+        """Return matched values, as jsonselect.select would."""
+        return compile(selector).select(self)
+
+    def iter_match(self, selector):
+        """Yield the Nodes matched by a compiled selector, in postorder."""
+        return self._match(selector.program, _Context())
+
+    def _match(self, program, context):
+        matched = set()
+        for head in program.heads:
+            matched.update(self._chain(program, head, context))
+        for pos in sorted(matched, key=self.post.__getitem__):
+            yield self.nodes[pos]
+
+    def _candidates(self, simple):
+        """Positions of the nodes which may match simple, in order."""
+        lists = []
+        if simple.key is not None:
+            lists.append(self.keys.get(simple.key, ()))
+        if simple.type == 'number':
+            # booleans are numbers too, as far as type selectors go
+            lists.append(sorted(itertools.chain(self.types.get('number', ()),
+                                                self.types.get('boolean',
+                                                               ()))))
+        elif simple.type is not None:
+            lists.append(self.types.get(simple.type, ()))
+        if not lists:
+            return range(len(self.nodes))
+        return min(lists, key=len)
+
+    def _chain(self, program, state, context):
+        """Positions of the nodes matching the chain starting at state."""
+        nodes = self.nodes
+        matched = None
+        combinator = None
+        stats = context.stats
+        while True:
+            positions = self._candidates(program.simples[state])
+            if stats is None:
+                candidates = [pos for pos in positions
+                              if program.test(state, nodes[pos], context)]
+            else:
+                # counted in batches, so limits are checked as we go
+                candidates = []
+                for start in range(0, len(positions), _CLOCK_NODES):
+                    batch = positions[start:start + _CLOCK_NODES]
+                    context.visit(len(batch))
+                    candidates.extend(pos for pos in batch if program.test(
+                        state, nodes[pos], context))
+            if matched is None:
+                matched = candidates
+            else:
+                lhs = matched
+                if combinator == '>':
+                    matched = self._children(lhs, candidates)
+                elif combinator == '~':
+                    matched = self._siblings(lhs, candidates)
+                else:
+                    matched = self._descendants(lhs, candidates)
+                if stats is not None:
+                    stats.joins.append((combinator, len(lhs),
+                                        len(candidates), len(matched)))
+
+            combinator = program.next[state]
+            if combinator is None or not matched:
+                return matched
+            state += 1
+
+    # The following joins take and return sorted lists of positions.
+
+    def _children(self, lhs, rhs):
+        """Positions in rhs whose parent is in lhs."""
+        parents = self.parents
+        lhs = set(lhs)
+        return [pos for pos in rhs if parents[pos] in lhs]
+
+    def _descendants(self, lhs, rhs):
+        """Positions in rhs with an ancestor in lhs."""
+        ends = self.ends
+        results = []
+        # ends of the subtrees in lhs which may still contain rhs nodes.
+        # subtrees nest, so the innermost ends first and is on top.
+        open_ends = []
+        i = 0
+        for pos in rhs:
+            while i < len(lhs) and lhs[i] < pos:
+                while open_ends and open_ends[-1] < lhs[i]:
+                    open_ends.pop()
+                open_ends.append(ends[lhs[i]])
+                i += 1
+            while open_ends and open_ends[-1] < pos:
+                open_ends.pop()
+            if open_ends:
+                results.append(pos)
+        return results
+
+    def _siblings(self, lhs, rhs):
+        """Positions in rhs with a sibling in lhs."""
+        parents = self.parents
+        counts = collections.defaultdict(int)
+        for pos in lhs:
+            counts[parents[pos]] += 1
+        lhs = set(lhs)
+        return [pos for pos in rhs if parents[pos] >= 0 and
+                counts.get(parents[pos], 0) > (pos in lhs)]
+
+
+class _LRUCache(object):
+
+    """A small, thread-safe mapping which evicts least recently used keys."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return None
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """Return the (key, value) pairs, least recently used first."""
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Stats(object):
+
+    """
+    What selections did, as counted by collect_stats.
+
+    nodes_visited   nodes reached and tested, including those within the
+                    subtrees searched by :has()
+    calls           validator kind -> number of calls, the kinds being
+                    those of SimpleSelector.tests: 'type', 'key', 'pclass',
+                    'nth-child', 'nth-last-child', 'has', 'expr', 'val' and
+                    'contains'
+    passed          combinator -> number of times a node matched the step
+                    before it and passed the next step on
+    joins           (combinator, lhs, rhs, result) sizes of each join of
+                    matches made when selecting from a Document
+    matches         nodes matched
+    evaluations     selections run
+    compiles        selectors compiled, and cache_hits those found cached
+    lex_time, parse_time, match_time
+                    seconds spent lexing and parsing selectors as they
+                    were compiled, and matching them
+    """
+
+    __slots__ = ('nodes_visited', 'calls', 'passed', 'joins', 'matches',
+                 'evaluations', 'compiles', 'cache_hits', 'lex_time',
+                 'parse_time', 'match_time')
+
+    def __init__(self):
+        self.nodes_visited = 0
+        self.calls = {}
+        self.passed = {}
+        self.joins = []
+        self.matches = 0
+        self.evaluations = 0
+        self.compiles = 0
+        self.cache_hits = 0
+        self.lex_time = 0.0
+        self.parse_time = 0.0
+        self.match_time = 0.0
+
+    def merge(self, other):
+        """Add the counts and timings of other to these."""
+        for name in self.__slots__:
+            value = getattr(other, name)
+            if isinstance(value, dict):
+                mine = getattr(self, name)
+                for key, count in value.items():
+                    mine[key] = mine.get(key, 0) + count
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        """Return the stats as a dict, which json can encode."""
+        stats = dict((name, getattr(self, name)) for name in self.__slots__)
+        stats['joins'] = [dict(zip(('combinator', 'lhs', 'rhs', 'result'),
+                                   join)) for join in self.joins]
+        return stats
+
+    def __repr__(self):
+        return 'Stats(%s)' % ', '.join('%s=%r' % (name, getattr(self, name))
+                                       for name in self.__slots__)
+
+
+class Limits(object):
+
+    """
+    Bounds on the selections run within a jsonselect.limits block, and
+    what they have used of them so far.
+
+    max_results         matches found, in all
+    timeout             seconds from entering the block
+    max_nodes_visited   nodes visited, counted as Stats.nodes_visited is
+    max_depth           depth below the root of the arrays and objects
+                        walked into; the walks :has() makes are counted
+                        from the node tested. Documents are indexed
+                        beforehand rather than walked, so aren't limited.
+
+    Limits left as None are unbounded.
+    """
+
+    __slots__ = ('max_results', 'timeout', 'max_nodes_visited', 'max_depth',
+                 'deadline', 'matches', 'nodes_visited')
+
+    def __init__(self, max_results=None, timeout=None,
+                 max_nodes_visited=None, max_depth=None):
+        self.max_results = max_results
+        self.timeout = timeout
+        self.max_nodes_visited = max_nodes_visited
+        self.max_depth = max_depth
+        self.deadline = None if timeout is None else _timer() + timeout
+        # used by the selections which have finished
+        self.matches = 0
+        self.nodes_visited = 0
+
+    def check(self, stats):
+        """Raise LimitExceeded if the selection counted by stats has gone
+        past a limit. Returns the count of nodes it may visit before it
+        goes past max_nodes_visited."""
+        allowed = float('inf')
+        if self.max_nodes_visited is not None:
+            allowed = self.max_nodes_visited - self.nodes_visited
+            if stats.nodes_visited > allowed:
+                raise LimitExceeded('max_nodes_visited',
+                                    self.max_nodes_visited, stats)
+        if self.deadline is not None and _timer() > self.deadline:
+            raise LimitExceeded('timeout', self.timeout, stats)
+        return allowed
+
+    def check_matches(self, stats):
+        """Raise LimitExceeded if the selection counted by stats has found
+        more matches than allowed."""
+        if (self.max_results is not None and
+                self.matches + stats.matches > self.max_results):
+            raise LimitExceeded('max_results', self.max_results, stats)
+
+
+_local = threading.local()
+_timer = timeit.default_timer
+# nodes visited between readings of the clock, when there is a timeout
+_CLOCK_NODES = 256
+
+
+def _collectors():
+    """The (Stats, callback) pairs collecting for this thread, if any."""
+    return getattr(_local, 'collectors', None)
+
+
+def _limits():
+    """The Limits in force in this thread, if any."""
+    return getattr(_local, 'limits', None)
+
+
+@contextlib.contextmanager
+def collect_stats(callback=None):
+    """Count what selections run in this thread do, and time them.
+
+    Yields a Stats, which the selections made within the block are added
+    to as they finish. If callback is given, it is also called with the
+    Stats of each selection as it finishes, which include the compiling of
+    selectors since the previous one. Blocks may be nested.
+
+    Selections run more slowly while stats are collected, and always by
+    walking the object, never through the shortcuts taken for plain
+    selectors or large arrays of numbers.
+    """
+    stats = Stats()
+    collector = (stats, callback)
+    if _collectors() is None:
+        _local.collectors = []
+        _local.pending = Stats()
+    _local.collectors.append(collector)
+    try:
+        yield stats
+    finally:
+        collectors = _local.collectors
+        # compiles which no selection has claimed count for every block
+        for aggregate, _ in collectors:
+            aggregate.merge(_local.pending)
+        _local.pending = Stats()
+        collectors.remove(collector)
+        if not collectors:
+            del _local.collectors
+
+
+@contextlib.contextmanager
+def limits(max_results=None, timeout=None, max_nodes_visited=None,
+           max_depth=None):
+    """Bound what selections run in this thread may do.
+
+    Within the block, a selection going past one of the limits raises
+    LimitExceeded, holding the Stats of the selection so far. The limits
+    are shared by all the selections made in the block: the timeout runs
+    from entering it, and matches and nodes visited are counted across
+    them (see Limits). Blocks may be nested, and the limits of each apply.
+
+    Limits apply to selections made through compiled selectors, such as
+    select, iselect and Document.match, which run as they do when stats
+    are collected while limits are in force.
+    """
+    bounds = Limits(max_results, timeout, max_nodes_visited, max_depth)
+    if _limits() is None:
+        _local.limits = []
+    _local.limits.append(bounds)
+    try:
+        yield bounds
+    finally:
+        _local.limits.remove(bounds)
+        if not _local.limits:
+            del _local.limits
+
+
+def _counted_compile(selector, compiled):
+    """compile, timing the lexing and parsing of selector when it isn't
+    cached."""
+    pending = _local.pending
+    if compiled is not None:
+        pending.cache_hits += 1
+        return compiled
+    start = _timer()
+    tokens = lex(selector)
+    lexed = _timer()
+    chains = Parser().selector_production(tokens)
+    pending.lex_time += lexed - start
+    pending.parse_time += _timer() - lexed
+    pending.compiles += 1
+    compiled = Selector(selector, chains, _Program(chains))
+    _cache.put(selector, compiled)
+    return compiled
+
+
+def _collected(selector, obj, limits=()):
+    """Yield the Nodes of obj matched by selector, as Selector._nodes
+    does, counting and timing the evaluation and enforcing limits."""
+    collectors = list(_collectors() or ())
+    if collectors:
+        stats = _local.pending
+        _local.pending = Stats()
+    else:
+        stats = Stats()
+    stats.evaluations += 1
+    program = _CountingProgram(selector.program, stats)
+    context = _Context(stats, limits)
+    if isinstance(obj, Document):
+        nodes = obj._match(program, context)
+    else:
+        nodes = _visit(program, Node(obj, None, None, None, None),
+                       program.floating, program.anchored, context)
+    try:
+        while True:
+            start = _timer()
+            try:
+                node = next(nodes)
+            except StopIteration:
+                return
+            finally:
+                stats.match_time += _timer() - start
+            stats.matches += 1
+            for bounds in limits:
+                bounds.check_matches(stats)
+            yield node
+    finally:
+        for bounds in limits:
+            bounds.matches += stats.matches
+            bounds.nodes_visited += stats.nodes_visited
+        for aggregate, callback in collectors:
+            aggregate.merge(stats)
+            if callback is not None:
+                callback(stats)
+
+
+_MAXCACHE = 512
+_cache = _LRUCache(_MAXCACHE)
+_lex_cache = _LRUCache(_MAXCACHE)
+
+
+def compile(selector):
+    """Compile selector into a reusable Selector.
+
+    Compiled selectors are kept in a bounded LRU cache keyed by the selector
+    string, so compiling the same selector again is cheap.
+    Raises SelectorSyntaxError if selector cannot be parsed.
+    """
+    if isinstance(selector, Selector):
+        return selector
+
+    compiled = _cache.get(selector)
+    if _collectors():
+        return _counted_compile(selector, compiled)
+    if compiled is None:
+        compiled = Parser().compile(selector)
+        _cache.put(selector, compiled)
+    return compiled
+
+
+def purge():
+    """Clear the caches of compiled selectors and lexed tokens."""
+    _cache.clear()
+    _lex_cache.clear()
+
+
 def select(selector, obj):
     """Appy selector to obj and return matching nodes.
 
+    selector may be a string or a Selector returned by compile.
     If only one node is found, return it, otherwise return a list of matches.
     Returns False on syntax error. None if no results found.
     """
 
-    parser = Parser(obj)
     try:
-        return parser.parse(selector)
+        return compile(selector).select(obj)
     except SelectorSyntaxError as e:
-        log.exception(e)
+        _log().exception(e)
         return False
+
+
+def iselect(selector, obj):
+    """Return an iterator over the values of obj matched by selector.
+
+    Matches are found as the iterator is consumed, in the order select
+    would list them, so stopping early skips the rest of the traversal.
+    Unlike select, raises SelectorSyntaxError for an invalid selector.
+    """
+    return compile(selector).iselect(obj)
+
+
+def select_first(selector, obj, default=None):
+    """Return the first value of obj matched by selector, or default.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return compile(selector).first(obj, default)
+
+
+def exists(selector, obj):
+    """Return whether selector matches any node of obj.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return compile(selector).exists(obj)
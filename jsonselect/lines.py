@@ -0,0 +1,87 @@
+"""
+Apply a selector to each document of a JSON Lines (NDJSON) stream.
+
+Public interface:
+    select_lines
+    take a selector and an iterable of lines. yield the JSON encoded
+    selection for each line, optionally fanning the work out to a pool of
+    processes.
+"""
+import collections
+import itertools
+import json
+
+from . import decoders
+from .jsonselect import compile
+
+# the selector and decoder used by worker processes, set by _init_worker
+_selector = None
+_loads = None
+
+
+def _init_worker(selector, decoder):
+    global _selector, _loads
+    _selector = compile(selector)
+    _loads = decoders.get(decoder)
+
+
+def _select_chunk(lines, selector=None, loads=None):
+    """Return the JSON encoded selection for each of lines."""
+    selector = selector or _selector
+    loads = loads or _loads
+    results = []
+    for line in lines:
+        if line.strip():
+            selection = selector.select(loads(line))
+        else:
+            selection = None
+        results.append(json.dumps(selection))
+    return results
+
+
+def _chunks(lines, size):
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def select_lines(selector, lines, jobs=1, chunk_size=1000, decoder='auto'):
+    """Apply selector to each JSON document in lines.
+
+    lines may be str or bytes, and are decoded with the named decoder (see
+    jsonselect.decoders). Yields, in input order, the selection for each
+    line encoded as JSON on a single line. Blank lines select null. With
+    jobs > 1, chunks of chunk_size lines are parsed and matched by a pool
+    of that many processes. Only a few chunks per process are read ahead
+    of the results consumed, so memory stays bounded on endless input.
+    Raises SelectorSyntaxError for an invalid selector, and ValueError for
+    an unknown decoder or a line which isn't valid JSON.
+    """
+    selector = compile(selector)
+    loads = decoders.get(decoder)
+
+    if jobs <= 1:
+        for chunk in _chunks(lines, chunk_size):
+            for result in _select_chunk(chunk, selector, loads):
+                yield result
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs, _init_worker,
+                                (selector.selector, decoder))
+    try:
+        pending = collections.deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.apply_async(_select_chunk, (chunk,)))
+            if len(pending) >= jobs * 2:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,391 @@
+"""
+Select from a single large JSON array with a pool of processes.
+
+Public interface:
+    select
+    like jsonselect.select, for a document in a file. the elements of its
+    outer array are decoded and matched by separate processes.
+
+    iter_matches
+    yield (path, value) for each match of a document in a file, in the
+    order select would list them.
+
+The file is split into byte ranges and each process maps the file and
+reads its own ranges, so nothing but the selector and the matches found
+passes between processes. A first pass over the ranges counts the quotes
+delimiting strings and the brackets outside them, which tells each range
+whether it starts inside a string and how deeply nested it starts. Each
+range then holds the elements of the outer array whose preceding '[' or
+',' falls within it, decoded with the standard library's json module.
+
+Positions among the elements of the outer array are counted in a pass of
+their own when the selector tests them (:first-child, :nth-child and the
+like), and the states the sibling combinator passes between them are
+found in rounds, as _sibling_states finds them, each over all the ranges.
+Selectors which may match the outer array itself, or test it with :has(),
+need the whole document and are run in this process as usual; so are
+documents other than arrays.
+"""
+import codecs
+import json
+import mmap
+import os
+import re
+
+from . import decoders
+from .jsonselect import Node, compile, _Context, _EMPTY, _step, _visit
+
+# bytes per range, at most
+_CHUNK_SIZE = 16 * 1024 * 1024
+# tests which depend on where a node is among its siblings
+_POSITIONAL = set([
+    ('pclass', 'first-child'),
+    ('pclass', 'last-child'),
+    ('pclass', 'only-child'),
+])
+_POSITIONAL_KINDS = set(['nth-child', 'nth-last-child'])
+
+_ESCAPE = re.compile(br'\\.', re.S)
+_STRING = re.compile(br'"[^"]*(?:"|$)')
+_STRUCTURE = re.compile(br'["\[\]{},]')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+_LEADING_SPACE = re.compile(br'[ \t\n\r]*')
+
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _clean(mapped, start, end):
+    """Return the bytes from start to end with every escaped character
+    blanked out, so the quotes left are those delimiting strings."""
+    data = mapped[start:end]
+    # an odd run of backslashes before start escapes the first byte
+    run = 0
+    while start - run > 0 and mapped[start - run - 1] in (92, b'\\'):
+        run += 1
+    if run % 2:
+        data = b'_' + data[1:]
+    if b'\\' in data:
+        data = _ESCAPE.sub(b'__', data)
+    return data
+
+
+def _depth_change(data):
+    """How much deeper data, outside strings, leaves the nesting."""
+    data = _STRING.sub(b'', data)
+    return (data.count(b'[') + data.count(b'{') -
+            data.count(b']') - data.count(b'}'))
+
+
+def _scan(task):
+    """Return the number of quotes delimiting strings in a range, and how
+    much it changes the nesting depth if it starts outside a string and if
+    it starts inside one."""
+    path, start, end = task
+    data = _clean(_map(path), start, end)
+    quote = data.find(b'"')
+    inside = 0 if quote < 0 else _depth_change(data[quote + 1:])
+    return data.count(b'"'), _depth_change(data), inside
+
+
+def _first_element(data, in_string, depth):
+    """Return the offset in data just past the first '[' or ',' opening an
+    element of the outer array, or None if there is none."""
+    for found in _STRUCTURE.finditer(data):
+        char = found.group()
+        if char == b'"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char in b'[{':
+            depth += 1
+            if depth == 1:
+                return found.end()
+        elif char in b']}':
+            depth -= 1
+            if depth == 0:
+                return None
+        elif depth == 1:
+            return found.end()
+    return None
+
+
+class _Text(object):
+
+    """Text decoded from a mapped file, decoding more as it is needed."""
+
+    def __init__(self, mapped, start, end):
+        self.mapped = mapped
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.read = start
+        self.block = end - start
+        self.text = u''
+        self.more()
+        self.block = max(self.block, 1 << 20)
+
+    def more(self):
+        """Decode the next block, doubling the next one. Returns False at
+        the end of the file."""
+        if self.read >= len(self.mapped):
+            return False
+        stop = self.read + self.block
+        self.text += self.decoder.decode(self.mapped[self.read:stop],
+                                         final=stop >= len(self.mapped))
+        self.read = stop
+        self.block *= 2
+        return True
+
+
+def _elements(path, start, end, in_string, depth):
+    """Yield the elements of the outer array whose preceding '[' or ','
+    lies between start and end, decoded."""
+    mapped = _map(path)
+    first = _first_element(_clean(mapped, start, end), in_string, depth)
+    if first is None:
+        return
+    text = _Text(mapped, start + first, end)
+    # separators past limit belong to the next range
+    limit = len(text.text)
+
+    pos = 0
+    while True:
+        pos = _WHITESPACE.match(text.text, pos).end()
+        if pos == len(text.text) and text.more():
+            continue
+        if text.text.startswith(']', pos):
+            # the outer array is empty
+            return
+        try:
+            value, stop = _raw_decode(text.text, pos)
+        except ValueError:
+            if text.more():
+                continue
+            raise
+        # a number cut short at the end of the text still decodes
+        if (_NUMBER_TAIL.match(text.text, stop).end() == len(text.text) and
+                text.more()):
+            continue
+        yield value
+
+        pos = _WHITESPACE.match(text.text, stop).end()
+        while pos == len(text.text) and text.more():
+            pos = _WHITESPACE.match(text.text, pos).end()
+        separator = text.text[pos:pos + 1]
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError("expected ',' or ']' at %r" %
+                             text.text[pos:pos + 20])
+        if pos >= limit:
+            return
+        pos += 1
+
+
+def _count(task):
+    """Return the number of elements of the outer array in a range."""
+    return sum(1 for _ in _elements(*task[:5]))
+
+
+def _sources(program, node, states, context):
+    """The states node passes on to its siblings, if tested against
+    states."""
+    return frozenset(s + 1 for s in states & program.sibling_states
+                     if program.test(s, node, context))
+
+
+def _replay(program, node, pending, history, context):
+    """Replay the rounds of _sibling_states for node, given the count of
+    elements passing on each state in each round so far.
+
+    Returns the states node gained before the last round and after it,
+    and the states it now passes on.
+    """
+    before = gained = _EMPTY
+    for counts in history:
+        sources = _sources(program, node, pending | gained, context)
+        before, gained = gained, frozenset(
+            s for s, count in counts.items() if count > (s in sources))
+    return before, gained, _sources(program, node, pending | gained,
+                                    context)
+
+
+def _element_nodes(task):
+    """Yield the Node of each element of a range, numbered from offset,
+    and the program and context to test it with."""
+    (path, start, end, in_string, depth, source, offset,
+     total) = task[:8]
+    program = compile(source).program
+    context = _Context()
+    root = Node([None], None, None, None, None)
+    for i, value in enumerate(_elements(path, start, end, in_string,
+                                        depth)):
+        yield program, Node(value, root, None, offset + i + 1,
+                            total), context
+
+
+def _sibling_round(task):
+    """Return the count of elements of a range passing on each state this
+    round, and whether any element gained states last round."""
+    descendants, children_only, history = task[8:]
+    pending = descendants | children_only
+    counts = {}
+    changed = False
+    for program, node, context in _element_nodes(task):
+        before, gained, sources = _replay(program, node, pending, history,
+                                          context)
+        changed = changed or before != gained
+        for s in sources:
+            counts[s] = counts.get(s, 0) + 1
+    return counts, changed
+
+
+def _match(task):
+    """Return the number of elements of a range, and (path, value) for
+    each match among them."""
+    descendants, children_only, history = task[8:]
+    pending = descendants | children_only
+    count = 0
+    matches = []
+    for program, node, context in _element_nodes(task):
+        count += 1
+        given = children_only
+        if history:
+            given = given | _replay(program, node, pending, history,
+                                    context)[1]
+        for hit in _visit(program, node, descendants, given, context):
+            matches.append((hit.path(), hit.value))
+    return count, matches
+
+
+def _serial(selector, path):
+    with open(path, 'rb') as f:
+        obj = decoders.load(f)
+    for node in selector.match(obj):
+        yield node.path(), node.value
+
+
+def _is_array(path):
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+    head = head[_LEADING_SPACE.match(head).end():]
+    return head.startswith(b'[')
+
+
+def iter_matches(selector, path, jobs=None, chunk_size=_CHUNK_SIZE):
+    """Yield (path, value) for each match of selector in the JSON document
+    in the file named path, in the order select would list them.
+
+    The elements of the document's outer array are matched by jobs
+    processes, as many as there are CPUs by default, in ranges of at most
+    chunk_size bytes. Documents no larger than chunk_size are read and
+    matched in this process.
+    Raises SelectorSyntaxError for an invalid selector, and ValueError if
+    the document isn't valid JSON.
+    """
+    import multiprocessing
+    selector = compile(selector)
+    program = selector.program
+    jobs = jobs or multiprocessing.cpu_count()
+    size = os.path.getsize(path)
+    if jobs <= 1 or size <= chunk_size or not _is_array(path):
+        for match in _serial(selector, path):
+            yield match
+        return
+
+    # the outer array stands in for itself, as far as it can be tested
+    # without its elements.
+    heads = program.floating | program.anchored
+    if any(program.has[s] for s in heads):
+        for match in _serial(selector, path):
+            yield match
+        return
+    root = Node([None], None, None, None, None)
+    matched, descendants, children_only = _step(
+        program, root, program.floating, program.anchored, _Context())
+    if matched:
+        for match in _serial(selector, path):
+            yield match
+        return
+    if not descendants | children_only:
+        return
+
+    chunk_size = min(chunk_size, max(1, size // (jobs * 4)))
+    ranges = [(path, start, min(start + chunk_size, size))
+              for start in range(0, size, chunk_size)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # whether each range starts inside a string, and how deep
+        states = []
+        quotes = depth = 0
+        for count, outside, inside in pool.map(_scan, ranges):
+            in_string = bool(quotes % 2)
+            states.append((in_string, depth))
+            quotes += count
+            depth += inside if in_string else outside
+        ranges = [r + state + (selector.selector,)
+                  for r, state in zip(ranges, states)]
+
+        positional = any(
+            test in _POSITIONAL or test[0] in _POSITIONAL_KINDS
+            for simple in program.simples for test in simple.tests)
+        siblings = bool((descendants | children_only) &
+                        program.sibling_states)
+        # elements are numbered within their range unless positions are
+        # tested, then renumbered as the matches come in
+        offsets = [0] * len(ranges)
+        total = None
+        if positional or siblings:
+            offsets = []
+            total = 0
+            for count in pool.map(_count, ranges):
+                offsets.append(total)
+                total += count
+
+        history = []
+        if siblings:
+            while True:
+                results = pool.map(_sibling_round, [
+                    r + (offset, total, descendants, children_only,
+                         history) for r, offset in zip(ranges, offsets)])
+                if history and not any(changed for _, changed in results):
+                    break
+                counts = {}
+                for round_counts, _ in results:
+                    for s, count in round_counts.items():
+                        counts[s] = counts.get(s, 0) + count
+                history.append(counts)
+
+        tasks = [r + (offset, total, descendants, children_only, history)
+                 for r, offset in zip(ranges, offsets)]
+        seen = 0
+        for count, matches in pool.imap(_match, tasks):
+            for match_path, value in matches:
+                if total is None:
+                    match_path = (match_path[0] + seen,) + match_path[1:]
+                yield match_path, value
+            seen += count
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def select(selector, path, jobs=None, chunk_size=_CHUNK_SIZE):
+    """Return the values matched by selector in the JSON document in the
+    file named path, as jsonselect.select would, using jobs processes as
+    iter_matches does.
+
+    Unlike jsonselect.select, raises SelectorSyntaxError for an invalid
+    selector.
+    """
+    results = [value for _, value in iter_matches(selector, path, jobs,
+                                                   chunk_size)]
+    if len(results) == 1:
+        return results[0]
+    elif not len(results):
+        return None
+    return results
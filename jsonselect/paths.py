@@ -0,0 +1,166 @@
+"""
+Locate matches by their paths, and edit objects in place through them.
+
+Public interface:
+    select_paths, select_pointers
+    take a selector and an object. return the path or the RFC 6901 JSON
+    Pointer of each match, without touching the matched values.
+
+    get_path, set_path, delete_path
+    read, replace or remove the value at a path or pointer.
+
+    update, delete
+    take a selector and an object. replace or remove every match in place.
+
+A path is a sequence of the dict keys and array indexes, counted from 0,
+leading from the root to a node. A pointer is the same as a string, such as
+'/items/0/id'; the root's path is () and its pointer ''.
+"""
+import sys
+
+from .jsonselect import compile
+
+if sys.version_info[0] >= 3:
+    basestring = str
+
+
+def select_paths(selector, obj):
+    """Return the path, as a tuple, of each node of obj matched by selector,
+    in the order select would list the matches.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return [node.path() for node in compile(selector).match(obj)]
+
+
+def select_pointers(selector, obj):
+    """Return the JSON Pointer of each node of obj matched by selector, in
+    the order select would list the matches.
+
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    return [node.pointer() for node in compile(selector).match(obj)]
+
+
+def split_pointer(pointer):
+    """Return the reference tokens of a JSON Pointer, unescaped.
+
+    Raises ValueError if pointer is neither empty nor starts with '/'.
+    """
+    if not pointer:
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError("invalid JSON Pointer %r" % pointer)
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in pointer[1:].split('/')]
+
+
+def _steps(path):
+    if isinstance(path, basestring):
+        return split_pointer(path)
+    return list(path)
+
+
+def _index(container, step):
+    """Return the index or key step refers to in container."""
+    if not isinstance(container, list):
+        return step
+    if isinstance(step, basestring):
+        if not step.isdigit() or (step != '0' and step.startswith('0')):
+            raise KeyError(step)
+        step = int(step)
+    if not 0 <= step < len(container):
+        raise IndexError(step)
+    return step
+
+
+def get_path(obj, path):
+    """Return the value of obj at path, a sequence of keys and indexes or
+    a JSON Pointer.
+
+    Raises KeyError or IndexError if there is no value there.
+    """
+    for step in _steps(path):
+        obj = obj[_index(obj, step)]
+    return obj
+
+
+def set_path(obj, path, value):
+    """Replace the value of obj at path with value, in place.
+
+    Returns obj, or value itself if path is the root. Raises KeyError or
+    IndexError if a container on the path is missing; a missing key of the
+    last object is added.
+    """
+    steps = _steps(path)
+    if not steps:
+        return value
+    container = get_path(obj, steps[:-1])
+    container[_index(container, steps[-1])] = value
+    return obj
+
+
+def delete_path(obj, path):
+    """Remove the value of obj at path, in place.
+
+    Raises KeyError or IndexError if there is no value there, and
+    ValueError for the root, which can't be removed.
+    """
+    steps = _steps(path)
+    if not steps:
+        raise ValueError("can't delete the root")
+    container = get_path(obj, steps[:-1])
+    del container[_index(container, steps[-1])]
+
+
+def update(selector, obj, func):
+    """Replace each value of obj matched by selector with func(value).
+
+    Matches are replaced in place, innermost first, so func is given a
+    container after the matches within it have been replaced. Returns
+    obj, or the replacement of obj if the root itself matched.
+    Raises SelectorSyntaxError for an invalid selector.
+    """
+    for node in compile(selector).match(obj):
+        value = func(node.value)
+        if node.parent is None:
+            obj = value
+        elif node.idx is not None:
+            node.parent.value[node.idx - 1] = value
+        else:
+            node.parent.value[node.parent_key] = value
+    return obj
+
+
+def delete(selector, obj):
+    """Remove each value of obj matched by selector, in place.
+
+    Returns the number of values removed, not counting those within
+    another removed value. Raises SelectorSyntaxError for an invalid
+    selector, and ValueError if the root matched.
+    """
+    nodes = compile(selector).match(obj)
+    removed = set(id(node) for node in nodes)
+    count = 0
+    # matches come in postorder; walking it backwards reaches the root
+    # before anything is removed, and removes later elements of an array
+    # before earlier ones, keeping their indexes.
+    for node in reversed(nodes):
+        if node.parent is None:
+            raise ValueError("can't delete the root")
+        if _within(node.parent, removed):
+            continue
+        if node.idx is not None:
+            del node.parent.value[node.idx - 1]
+        else:
+            del node.parent.value[node.parent_key]
+        count += 1
+    return count
+
+
+def _within(node, removed):
+    while node is not None:
+        if id(node) in removed:
+            return True
+        node = node.parent
+    return False
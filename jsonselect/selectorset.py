@@ -0,0 +1,278 @@
+"""
+Match many selectors against a document in a single traversal.
+
+Public interface:
+    SelectorSet
+    a set of selectors, each registered under a rule id. match a document
+    against all of them at once.
+
+The selectors of a set are compiled together into a trie: chains starting
+with the same steps share the states for them, so a step common to many
+rules is tested once per node. The states a node is tested against are
+then looked up by the node's key and type, so rules which can't match it
+cost nothing. A traversal costs in proportion to the size of the document
+and the number of matches, rather than to the number of rules.
+"""
+import collections
+import threading
+
+from .jsonselect import (Node, compile, _Context, _Has, _child_nodes,
+                         _type_name, _SCALARS, _EMPTY)
+
+# dispatch tables kept per set before they are rebuilt from scratch
+_MAXDISPATCH = 4096
+
+
+class _Dispatch(object):
+
+    """The states of a set of states, by the key and type they require."""
+
+    __slots__ = ('by_key', 'by_type', 'generic')
+
+    def __init__(self, rules, states):
+        self.by_key = collections.defaultdict(list)
+        self.by_type = collections.defaultdict(list)
+        self.generic = []
+        for state in states:
+            simple = rules.simples[state]
+            if simple.key is not None:
+                self.by_key[simple.key].append(state)
+            elif simple.type == 'number':
+                # booleans are numbers too, as far as type selectors go
+                self.by_type['number'].append(state)
+                self.by_type['boolean'].append(state)
+            elif simple.type is not None:
+                self.by_type[simple.type].append(state)
+            else:
+                self.generic.append(state)
+
+    def candidates(self, node, type_name):
+        """Return lists of the states node could match."""
+        lists = [self.generic]
+        if node.parent_key is not None and node.parent_key in self.by_key:
+            lists.append(self.by_key[node.parent_key])
+        if type_name in self.by_type:
+            lists.append(self.by_type[type_name])
+        return lists
+
+
+class SelectorSet(object):
+
+    """
+    A set of selectors matched together.
+
+    Each selector is added under a rule id, which may be any hashable
+    value. Matching returns a dict from the id of each rule which matched
+    to its matches, in the order select would list them.
+
+    A set may be matched by several threads at once, but rules must not
+    be added while it is being matched. Matching fills in a shared table
+    of the states to try for each set of states; it is built under the
+    set's lock, and only ever added to or thrown away whole.
+    """
+
+    def __init__(self, rules=()):
+        """rules may be a mapping or an iterable of (rule_id, selector)."""
+        # the trie of states. every state is a step of some chain.
+        self.simples = []
+        self.validators = []
+        self.has = []
+        self.rules = []         # ids of the rules ending at each state
+        self.descendant = []    # states passed on by ' ', per state
+        self.child = []         # states passed on by '>', per state
+        self.sibling = []       # states passed on by '~', per state
+        self.heads = _EMPTY
+        self.sibling_sources = _EMPTY
+        self._edges = {}
+        self._dispatch = {}
+        self._lock = threading.Lock()
+
+        if hasattr(rules, 'items'):
+            rules = rules.items()
+        for rule_id, selector in rules:
+            self.add(rule_id, selector)
+
+    def __len__(self):
+        return len(set(rule_id for ids in self.rules for rule_id in ids))
+
+    def add(self, rule_id, selector):
+        """Add selector under rule_id.
+
+        Adding several selectors under the same id is like joining them
+        with ','. Raises SelectorSyntaxError for an invalid selector.
+        """
+        selector = compile(selector)
+        with self._lock:
+            for chain in selector.chains:
+                state = None
+                for combinator, simple in chain:
+                    state = self._state(state, combinator, simple)
+                if rule_id not in self.rules[state]:
+                    self.rules[state] = self.rules[state] + (rule_id,)
+            self._dispatch = {}
+
+    def _state(self, previous, combinator, simple):
+        """Return the state for simple following previous, adding it if
+        the trie doesn't have one yet."""
+        edge = (previous, combinator, simple.source)
+        if edge in self._edges:
+            return self._edges[edge]
+
+        state = len(self.simples)
+        self._edges[edge] = state
+        self.simples.append(simple)
+        self.validators.append(tuple(v for v in simple.validators
+                                     if not isinstance(v, _Has)))
+        self.has.append(tuple(v for v in simple.validators
+                              if isinstance(v, _Has)))
+        self.rules.append(())
+        self.descendant.append(_EMPTY)
+        self.child.append(_EMPTY)
+        self.sibling.append(_EMPTY)
+
+        successor = frozenset((state,))
+        if previous is None:
+            self.heads = self.heads | successor
+        elif combinator == '>':
+            self.child[previous] = self.child[previous] | successor
+        elif combinator == '~':
+            self.sibling[previous] = self.sibling[previous] | successor
+            self.sibling_sources = self.sibling_sources | frozenset(
+                (previous,))
+        else:
+            self.descendant[previous] = (self.descendant[previous] |
+                                         successor)
+        return state
+
+    def match(self, obj):
+        """Return a dict of the Nodes of obj matched by each rule.
+
+        Rules which matched nothing are left out.
+        """
+        results = {}
+        for node, rule_ids in self._visit(obj):
+            for rule_id in rule_ids:
+                results.setdefault(rule_id, []).append(node)
+        return results
+
+    def select(self, obj):
+        """Return a dict of the values of obj matched by each rule.
+
+        Rules which matched nothing are left out.
+        """
+        results = {}
+        for node, rule_ids in self._visit(obj):
+            for rule_id in rule_ids:
+                results.setdefault(rule_id, []).append(node.value)
+        return results
+
+    def _test(self, state, node, context):
+        for validate in self.validators[state]:
+            if not validate(node):
+                return False
+        for has in self.has[state]:
+            if not has.check(node, context):
+                return False
+        return True
+
+    def _candidates(self, states, node, type_name):
+        dispatch = self._dispatch.get(states)
+        if dispatch is None:
+            with self._lock:
+                dispatch = self._dispatch.get(states)
+                if dispatch is None:
+                    if len(self._dispatch) >= _MAXDISPATCH:
+                        self._dispatch = {}
+                    dispatch = _Dispatch(self, states)
+                    self._dispatch[states] = dispatch
+        return dispatch.candidates(node, type_name)
+
+    def _step(self, node, inherited, given, context):
+        """Test node against the states passed down to it.
+
+        Returns a tuple of the ids of the rules node matched, the states
+        to pass to all of its descendants and the states to pass only to
+        its children.
+        """
+        rule_ids = set()
+        descendants = inherited
+        children_only = _EMPTY
+        type_name = _type_name(node.value)
+
+        lists = self._candidates(inherited, node, type_name)
+        if given:
+            lists = lists + self._candidates(given, node, type_name)
+        for states in lists:
+            for state in states:
+                if not self._test(state, node, context):
+                    continue
+                rule_ids.update(self.rules[state])
+                if self.descendant[state]:
+                    descendants = descendants | self.descendant[state]
+                if self.child[state]:
+                    children_only = children_only | self.child[state]
+        return rule_ids, descendants, children_only
+
+    def _sibling_states(self, children, states, context):
+        """Find the states each child gains through the sibling combinator.
+
+        Like jsonselect._sibling_states, for the states of the trie.
+        """
+        gained = [_EMPTY] * len(children)
+        while True:
+            sources = []
+            counts = collections.defaultdict(int)
+            for i, child in enumerate(children):
+                matched = set()
+                for state in (states | gained[i]) & self.sibling_sources:
+                    if self._test(state, child, context):
+                        matched.update(self.sibling[state])
+                sources.append(matched)
+                for state in matched:
+                    counts[state] += 1
+            updated = [frozenset(s for s, count in counts.items()
+                                 if count > (s in sources[i]))
+                       for i in range(len(children))]
+            if updated == gained:
+                return gained
+            gained = updated
+
+    def _given_children(self, node, descendants, children_only, context):
+        states = descendants | children_only
+        if self.sibling_sources and states & self.sibling_sources:
+            children = list(_child_nodes(node))
+            gained = self._sibling_states(children, states, context)
+            for child, child_gained in zip(children, gained):
+                yield child, children_only | child_gained
+        else:
+            for child in _child_nodes(node):
+                yield child, children_only
+
+    def _visit(self, obj):
+        """Yield (node, rule ids) for each matched node of obj, in
+        postorder. The traversal mirrors jsonselect._visit."""
+        context = _Context()
+        node = Node(obj, None, None, None, None)
+        rule_ids, descendants, children_only = self._step(
+            node, self.heads, _EMPTY, context)
+        stack = [(node, rule_ids, descendants, self._given_children(
+            node, descendants, children_only, context))]
+
+        while stack:
+            frame = stack[-1]
+            descendants = frame[2]
+            for child, child_given in frame[3]:
+                rule_ids, child_descendants, children_only = self._step(
+                    child, descendants, child_given, context)
+                if type(child.value) not in _SCALARS:
+                    stack.append((child, rule_ids, child_descendants,
+                                  self._given_children(
+                                      child, child_descendants,
+                                      children_only, context)))
+                    break
+                if rule_ids:
+                    yield child, rule_ids
+            else:
+                stack.pop()
+                if frame[1]:
+                    yield frame[0], frame[1]
@@ -0,0 +1,261 @@
+"""
+Streaming selection over JSON documents too large to load.
+
+Public interface:
+    stream_select
+    take a selector and a file object. yield matched values as the
+    document is read.
+
+The document is read a chunk at a time and never held in memory as a
+whole; only the nodes on the current path and the values of matches being
+built are kept. This limits selectors to those which can be decided from
+the path to a node: types, keys, :root, :first-child, :nth-child, :val,
+:contains, :expr and the descendant and child combinators.
+"""
+import codecs
+import json
+import re
+import sys
+
+from .jsonselect import Node, compile, lex, _Context, _step
+
+if sys.version_info[0] >= 3:
+    unicode = str
+
+# selectors needing a node's siblings or contents, which aren't known when
+# a streamed node is reached.
+_UNSTREAMABLE = set([
+    ('pclass', 'last-child'),
+    ('pclass', 'only-child'),
+    ('pclass', 'empty'),
+    ('nth_func', 'nth-last-child'),
+    ('pclass_func', 'has'),
+    ('operator', '~'),
+])
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+_STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+# characters which may continue a number or a literal
+_TOKEN_CHARS = re.compile(r'[0-9a-zA-Z.+\-]*')
+_LITERALS = {'true': True, 'false': False, 'null': None}
+_STRUCTURAL = '{}[],:'
+
+_scanstring = json.decoder.scanstring
+
+
+class _Reader(object):
+
+    """Pulls JSON tokens from a file object, reading a chunk at a time."""
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = None
+
+    def _fill(self):
+        """Read another chunk into the buffer. Returns False at EOF."""
+        if self.eof:
+            return False
+        raw = data = self.fp.read(self.chunk_size)
+        if not isinstance(data, unicode):
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder('utf-8')()
+            # part of a character decodes to nothing until the rest is read
+            data = self.decoder.decode(raw, final=not raw)
+        if not raw:
+            self.eof = True
+            return False
+        # drop what has been consumed before growing the buffer
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def error(self, msg):
+        return ValueError("%s near %r" % (msg, self.buf[self.pos:
+                                                        self.pos + 20]))
+
+    def next(self):
+        """Return the next token, as a (type, value) pair.
+
+        type is one of the structural characters, 'string' or 'value', or
+        None at the end of input.
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                break
+            if not self._fill():
+                return None, None
+
+        char = self.buf[self.pos]
+        if char in _STRUCTURAL:
+            self.pos += 1
+            return char, None
+
+        if char == '"':
+            while True:
+                end = _STRING_END.match(self.buf, self.pos + 1)
+                if end is not None:
+                    break
+                if not self._fill():
+                    raise self.error("unterminated string")
+            value, self.pos = _scanstring(self.buf, self.pos + 1)
+            return 'string', value
+
+        while True:
+            # a token running into the end of the buffer may continue in
+            # the next chunk.
+            end = _TOKEN_CHARS.match(self.buf, self.pos).end()
+            if end < len(self.buf) or not self._fill():
+                break
+        number = _NUMBER.match(self.buf, self.pos)
+        literal = self.buf[self.pos:self.pos + 5]
+
+        if number is not None:
+            self.pos = number.end()
+            if number.group(1) or number.group(2):
+                return 'value', float(number.group())
+            return 'value', int(number.group())
+
+        for word, value in _LITERALS.items():
+            if literal.startswith(word):
+                self.pos += len(word)
+                return 'value', value
+        raise self.error("unexpected character")
+
+
+class _Frame(object):
+
+    """An object or array on the current path."""
+
+    __slots__ = ('node', 'descendants', 'children_only', 'matched', 'value',
+                 'is_array', 'count', 'key')
+
+    def __init__(self, node, descendants, children_only, matched, value,
+                 is_array):
+        self.node = node
+        self.descendants = descendants
+        self.children_only = children_only
+        self.matched = matched
+        # the object or array being built, when it or an ancestor matched
+        self.value = value
+        self.is_array = is_array
+        self.count = 0
+        self.key = None
+
+
+def check_streamable(selector):
+    """Raise ValueError if selector can't be evaluated while streaming."""
+    for token in lex(selector.selector):
+        if token in _UNSTREAMABLE:
+            raise ValueError("%s%s can't be evaluated while streaming" % (
+                ':' if token[0] != 'operator' else '', token[1]))
+
+
+def stream_select(selector, fp, chunk_size=65536):
+    """Apply selector to the JSON document read from fp.
+
+    fp may be opened in text or binary mode. Yields matched values in the
+    order select would list them, each as soon as it has been read.
+    Raises ValueError if the selector can't be streamed or the document
+    isn't valid JSON.
+    """
+    selector = compile(selector)
+    check_streamable(selector)
+    program = selector.program
+    context = _Context()
+    reader = _Reader(fp, chunk_size)
+
+    stack = []
+    token, value = reader.next()
+    if token is None:
+        raise reader.error("no JSON document")
+
+    while True:
+        # token starts a value; work out where it sits in its parent.
+        parent = stack[-1] if stack else None
+        if parent is None:
+            parent_node = key = idx = None
+            inherited, given = program.floating, program.anchored
+        else:
+            parent_node = parent.node
+            inherited = parent.descendants
+            given = parent.children_only
+            if parent.is_array:
+                parent.count += 1
+                key, idx = None, parent.count
+            else:
+                key, idx = parent.key, None
+
+        if token in ('{', '['):
+            is_array = token == '['
+            # contents aren't known yet, which is fine for the predicates
+            # allowed by check_streamable.
+            node = Node([] if is_array else {}, parent_node, key, idx, None)
+            matched, descendants, children_only = _step(
+                program, node, inherited, given, context)
+            built = None
+            if matched or (parent is not None and parent.value is not None):
+                built = [] if is_array else {}
+                if parent is not None and parent.value is not None:
+                    _add(parent, built)
+            stack.append(_Frame(node, descendants, children_only, matched,
+                                built, is_array))
+        elif token in ('string', 'value'):
+            node = Node(value, parent_node, key, idx, None)
+            matched = _step(program, node, inherited, given, context)[0]
+            if parent is not None and parent.value is not None:
+                _add(parent, value)
+            if matched:
+                yield value
+        else:
+            raise reader.error("expecting value")
+
+        # read on to the start of the next value, closing containers.
+        while True:
+            token, value = reader.next()
+            if not stack:
+                if token is not None:
+                    raise reader.error("extra data")
+                return
+
+            frame = stack[-1]
+            if frame.is_array:
+                if token == ']':
+                    stack.pop()
+                    if frame.matched:
+                        yield frame.value
+                    continue
+                if frame.count:
+                    if token != ',':
+                        raise reader.error("expecting ',' or ']'")
+                    token, value = reader.next()
+                break
+
+            if token == '}':
+                stack.pop()
+                if frame.matched:
+                    yield frame.value
+                continue
+            if frame.key is not None:
+                if token != ',':
+                    raise reader.error("expecting ',' or '}'")
+                token, value = reader.next()
+            if token != 'string':
+                raise reader.error("expecting property name")
+            frame.key = value
+            if reader.next()[0] != ':':
+                raise reader.error("expecting ':'")
+            token, value = reader.next()
+            break
+
+
+def _add(frame, value):
+    if frame.is_array:
+        frame.value.append(value)
+    else:
+        frame.value[frame.key] = value
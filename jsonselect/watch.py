@@ -0,0 +1,259 @@
+"""
+Keep the matches of selectors up to date as an object is edited.
+
+Public interface:
+    WatchedDocument
+    an object edited through set, insert, delete and patch, and the
+    selectors watching it. each edit re-checks only the part of the object
+    it can have changed the matches of, and reports the matches it added
+    and removed.
+
+Matches are kept by their path, the tuple of keys and indexes leading to
+them (see jsonselect.paths). An edit at a path changes the nodes below it,
+and for insertions and deletions the positions of its siblings too, so
+only the subtree of the node edited, or of its parent, is evaluated again,
+with the states its ancestors pass down to it. Selectors using the sibling
+combinator re-check one level further up, since the siblings of an edited
+node may match differently. Selectors using :has() are evaluated again in
+full, as any ancestor of an edit may gain or lose a descendant.
+"""
+import collections
+
+from .jsonselect import (Node, compile, _Context, _child_nodes,
+                         _sibling_states, _step, _visit)
+from .paths import _index, _steps
+
+Event = collections.namedtuple('Event', [
+    'kind',         # 'added' or 'removed'
+    'selector',     # the compiled Selector whose matches changed
+    'path',         # the path of the match
+    'value',        # the value matched, for removals the one removed
+])
+
+
+def _programs(program):
+    """Yield program and the programs of the :has() selectors within it."""
+    yield program
+    for state_has in program.has:
+        for has in state_has:
+            for inner in _programs(has.program):
+                yield inner
+
+
+class _Watch(object):
+
+    """A selector watching a document, and its matches."""
+
+    __slots__ = ('selector', 'callback', 'matches', 'has', 'siblings')
+
+    def __init__(self, selector, callback):
+        self.selector = selector
+        self.callback = callback
+        self.matches = {}   # path -> value matched
+        programs = list(_programs(selector.program))
+        self.has = len(programs) > 1
+        self.siblings = any(program.sibling_states for program in programs)
+
+
+class WatchedDocument(object):
+
+    """
+    An object, and the selectors watching it for matches.
+
+    The object may only be edited through the methods below while it is
+    watched; edits made to it directly go unnoticed. A match whose value is
+    replaced by another is reported as removed, then added.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        # selector source -> _Watch
+        self._watches = collections.OrderedDict()
+
+    def watch(self, selector, callback=None):
+        """Start keeping the matches of selector, and return them.
+
+        If callback is given, it is called with an Event for each match
+        added or removed by later edits. Watching a selector again replaces
+        its callback. Raises SelectorSyntaxError for an invalid selector.
+        """
+        selector = compile(selector)
+        watch = _Watch(selector, callback)
+        for node in _evaluate_at(selector.program, self.obj, ()):
+            watch.matches[node.path()] = node.value
+        self._watches[selector.selector] = watch
+        return self.matches(selector)
+
+    def unwatch(self, selector):
+        """Stop keeping the matches of selector."""
+        del self._watches[compile(selector).selector]
+
+    def matches(self, selector):
+        """Return (path, value) for each match of a watched selector, in
+        the order select would list them."""
+        matches = self._watches[compile(selector).selector].matches
+        positions = {}
+
+        def position(container, step):
+            if isinstance(container, list):
+                return step
+            if id(container) not in positions:
+                positions[id(container)] = dict(
+                    (key, i) for i, key in enumerate(container))
+            return positions[id(container)][step]
+
+        def order(path):
+            # descendants come before their ancestors, as in postorder
+            key = []
+            container = self.obj
+            for step in path:
+                key.append(position(container, step))
+                container = container[step]
+            key.append(float('inf'))
+            return key
+
+        return [(path, matches[path]) for path in sorted(matches, key=order)]
+
+    def set(self, path, value):
+        """Set the value at path, a sequence of keys and indexes or a JSON
+        Pointer. A missing key of the last object is added.
+
+        Raises KeyError or IndexError if a container on the path is missing.
+        """
+        steps = _steps(path)
+        if not steps:
+            self.obj = value
+            self._refresh(())
+            return
+        parent, container = self._resolve(steps[:-1])
+        key = _index(container, steps[-1])
+        added = not isinstance(container, list) and key not in container
+        container[key] = value
+        # a new key changes what its container holds, as insert does
+        self._refresh(parent if added else parent + (key,))
+
+    def insert(self, path, value):
+        """Insert value at path. The last step is the index in its array
+        to insert before, which may be its length or '-' to append; for
+        objects, insert is set.
+
+        Raises KeyError or IndexError if a container on the path is missing.
+        """
+        steps = _steps(path)
+        if not steps:
+            raise ValueError("can't insert at the root")
+        parent, container = self._resolve(steps[:-1])
+        if not isinstance(container, list):
+            self.set(steps, value)
+            return
+        if steps[-1] in ('-', len(container), str(len(container))):
+            index = len(container)
+        else:
+            index = _index(container, steps[-1])
+        container.insert(index, value)
+        self._refresh(parent)
+
+    def delete(self, path):
+        """Remove the value at path.
+
+        Raises KeyError or IndexError if there is no value there, and
+        ValueError for the root.
+        """
+        steps = _steps(path)
+        if not steps:
+            raise ValueError("can't delete the root")
+        parent, container = self._resolve(steps[:-1])
+        del container[_index(container, steps[-1])]
+        self._refresh(parent)
+
+    def patch(self, operations):
+        """Apply JSON Patch (RFC 6902) 'add', 'remove' and 'replace'
+        operations, in order.
+
+        Raises ValueError for other operations, and KeyError or IndexError
+        for paths which aren't there.
+        """
+        for operation in operations:
+            op = operation['op']
+            if op == 'add':
+                self.insert(operation['path'], operation['value'])
+            elif op == 'remove':
+                self.delete(operation['path'])
+            elif op == 'replace':
+                # unlike set, replace needs the value to be there
+                steps = _steps(operation['path'])
+                if steps:
+                    _, container = self._resolve(steps[:-1])
+                    container[_index(container, steps[-1])]
+                self.set(steps, operation['value'])
+            else:
+                raise ValueError("unsupported patch operation %r" % op)
+
+    def _resolve(self, steps):
+        """Return the path of steps, with array indexes as ints, and the
+        value there."""
+        path = []
+        obj = self.obj
+        for step in steps:
+            step = _index(obj, step)
+            path.append(step)
+            obj = obj[step]
+        return tuple(path), obj
+
+    def _refresh(self, edited):
+        """Evaluate each watch again below edited, the path of the highest
+        node an edit changed, and report what changed."""
+        for watch in list(self._watches.values()):
+            if watch.has:
+                top = ()
+            elif watch.siblings:
+                top = edited[:-1]
+            else:
+                top = edited
+
+            old = dict((path, value) for path, value in watch.matches.items()
+                       if path[:len(top)] == top)
+            new = {}
+            for node in _evaluate_at(watch.selector.program, self.obj, top):
+                new[node.path()] = node.value
+
+            removed = [path for path in old
+                       if path not in new or new[path] is not old[path]]
+            added = [path for path in new
+                     if path not in old or old[path] is not new[path]]
+            for path in removed:
+                del watch.matches[path]
+            watch.matches.update(new)
+            if watch.callback is not None:
+                for path in removed:
+                    watch.callback(Event('removed', watch.selector, path,
+                                         old[path]))
+                for path in added:
+                    watch.callback(Event('added', watch.selector, path,
+                                         new[path]))
+
+
+def _evaluate_at(program, obj, path):
+    """Yield the Nodes matched by program in the subtree of obj at path, in
+    postorder, testing them with the states passed down from the root."""
+    context = _Context()
+    node = Node(obj, None, None, None, None)
+    inherited, given = program.floating, program.anchored
+    for step in path:
+        matched, inherited, children_only = _step(program, node, inherited,
+                                                  given, context)
+        given = children_only
+        pending = inherited | children_only
+        if program.sibling_states and pending & program.sibling_states:
+            children = list(_child_nodes(node))
+            position = step if isinstance(node.value, list) else list(
+                node.value).index(step)
+            gained = _sibling_states(program, children, pending, context)
+            node = children[position]
+            given = given | gained[position]
+        elif isinstance(node.value, list):
+            node = Node(node.value[step], node, None, step + 1,
+                        len(node.value))
+        else:
+            node = Node(node.value[step], node, step, None, None)
+    return _visit(program, node, inherited, given, context)
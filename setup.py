@@ -16,6 +16,9 @@ setup(
     url='https://github.com/mwhooker/jsonselect',
     license='ISC',
     packages=['jsonselect', 'tests'],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
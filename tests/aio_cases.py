@@ -0,0 +1,47 @@
+"""
+Tests of jsonselect.aio, imported by test_aio on Python 3.5 and later,
+as they are written with async def.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from jsonselect import aio, jsonselect
+
+
+class TestAio(TestCase):
+
+    def setUp(self):
+        self.obj = {'a': [{'b': 1}, {'b': 2}], 'c': 'x'}
+
+    def run_async(self, awaitable):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(awaitable)
+        finally:
+            loop.close()
+
+    def test_helpers(self):
+        async def main():
+            return await asyncio.gather(
+                aio.select('.b', self.obj),
+                aio.select('.c', self.obj),
+                aio.select_first('.nope', self.obj, 5),
+                aio.exists('.a number', self.obj),
+                aio.select_pointers('.b', self.obj))
+        self.assertEqual(self.run_async(main()),
+                         [[1, 2], 'x', 5, True, ['/a/0/b', '/a/1/b']])
+
+    def test_executor(self):
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+
+        async def main():
+            selector = jsonselect.compile('.b')
+            return await aio.select(selector, self.obj, executor=executor)
+        self.assertEqual(self.run_async(main()), [1, 2])
+
+    def test_invalid_selector(self):
+        async def main():
+            return aio.select('a[', self.obj)
+        self.assertRaises(jsonselect.SelectorSyntaxError, self.run_async,
+                          main())
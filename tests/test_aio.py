@@ -0,0 +1,5 @@
+import sys
+
+# coroutines are a syntax error before Python 3.5
+if sys.version_info >= (3, 5):
+    from .aio_cases import TestAio
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from jsonselect import cache, compile, select, Document
+from jsonselect import jsonselect
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.obj = {
+            'people': [
+                {'name': 'ann', 'age': 31, 'tags': ['a', 'b']},
+                {'name': 'bob', 'age': 22, 'admin': True, 'tags': []},
+            ],
+            'owner': {'name': 'cy', 'age': None},
+        }
+        self.data = json.dumps(self.obj).encode('utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, data=None):
+        return cache.load_document(io.BytesIO(data or self.data),
+                                   self.directory)
+
+    def test_index_is_stored_and_reused(self):
+        built = self.load()
+        self.assertEqual(type(built), Document)
+        stored = self.load()
+        self.assertNotEqual(type(stored), Document)
+        self.assertEqual(stored.obj, self.obj)
+        self.assertEqual(len(stored), len(built))
+
+        for selector in ['.name', 'number', '.people .name', '.age ~ .tags',
+                         '.people > * > .name', ':nth-child(2)', 'null',
+                         'object:has(.admin) > .name', ':root']:
+            self.assertEqual(select(selector, stored),
+                             select(selector, self.obj), selector)
+            self.assertEqual(
+                [node.path() for node in compile(selector).match(stored)],
+                [node.path() for node in compile(selector).match(self.obj)],
+                selector)
+
+    def test_other_documents_are_indexed_again(self):
+        self.load()
+        other = json.dumps({'name': 'dee'}).encode('utf-8')
+        document = self.load(other)
+        self.assertEqual(type(document), Document)
+        self.assertEqual(select('.name', document), 'dee')
+
+    def test_invalid_index_is_ignored(self):
+        self.load()
+        digest = [name for name in os.listdir(self.directory)
+                  if name.endswith('.idx')][0]
+        path = os.path.join(self.directory, digest)
+        self.assertIsNone(cache.read_index(path, self.obj, '00' * 32))
+        with open(path, 'r+b') as f:
+            f.write(b'garbage!')
+        self.assertIsNone(cache.read_index(path, self.obj))
+        document = self.load()
+        self.assertEqual(type(document), Document)
+        self.assertIsNotNone(cache.read_index(path, self.obj))
+
+    def test_incomplete_header_is_ignored(self):
+        self.load()
+        name = [name for name in os.listdir(self.directory)
+                if name.endswith('.idx')][0]
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, digest, length = cache._PREAMBLE.unpack_from(data)
+        start = cache._PREAMBLE.size
+        header = json.loads(data[start:start + length].decode('utf-8'))
+        del header['types']
+        header = json.dumps(header).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(cache._PREAMBLE.pack(magic, digest, len(header)) +
+                    header + data[start + length:])
+        self.assertIsNone(cache.read_index(path, self.obj))
+        self.assertEqual(type(self.load()), Document)
+
+    def test_selectors(self):
+        jsonselect.purge()
+        compile('.people > object:expr(x = 1)')
+        cache.save_selectors(self.directory)
+        jsonselect.purge()
+        self.assertEqual(cache.load_selectors(self.directory), 2)
+        self.assertEqual(len(jsonselect._lex_cache), 2)
+        self.assertEqual(select('.people > object .name', self.obj),
+                         ['ann', 'bob'])
+
+    def test_loaded_selectors_need_no_patterns(self):
+        jsonselect.purge()
+        compile('.people > object:expr(x = 1)')
+        cache.save_selectors(self.directory)
+        jsonselect.purge()
+        scanners = (jsonselect.SCANNER, jsonselect.EXPR_SCANNER,
+                    jsonselect.ARGS_SCANNER)
+        patterns = [scanner._pattern for scanner in scanners]
+        try:
+            for scanner in scanners:
+                scanner._pattern = None
+            cache.load_selectors(self.directory)
+            compile('.people > object:expr(x = 1)')
+            self.assertEqual([scanner._pattern for scanner in scanners],
+                             [None] * 3)
+        finally:
+            for scanner, pattern in zip(scanners, patterns):
+                scanner._pattern = pattern
+
+    def test_clear(self):
+        self.load()
+        compile('.name')
+        cache.save_selectors(self.directory)
+        cache.clear(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
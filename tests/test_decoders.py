@@ -0,0 +1,121 @@
+import gc
+import io
+import json
+import math
+import os
+import tempfile
+from unittest import TestCase
+from jsonselect import decoders
+
+
+class TestDecoders(TestCase):
+
+    def setUp(self):
+        self.doc = b'{"a": [1, 2.5, "x"], "b": null}'
+        self.obj = {'a': [1, 2.5, 'x'], 'b': None}
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.doc)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_loads(self):
+        for name in decoders.available() + ['auto']:
+            self.assertEqual(decoders.loads(self.doc, name), self.obj, name)
+            self.assertEqual(decoders.loads(self.doc.decode('utf-8'), name),
+                             self.obj, name)
+            self.assertEqual(decoders.loads(bytearray(self.doc), name),
+                             self.obj, name)
+
+    def test_pause_gc(self):
+        seen = []
+
+        def loads(data):
+            seen.append(gc.isenabled())
+            return json.loads(data)
+
+        decoders.register('spy', lambda: loads)
+        self.addCleanup(decoders._factories.pop, 'spy')
+        self.addCleanup(decoders._decoders.pop, 'spy', None)
+        enabled = gc.isenabled()
+        self.addCleanup(gc.enable if enabled else gc.disable)
+        gc.enable()
+        decoders.loads(self.doc, 'spy')
+        decoders.loads(self.doc, 'spy', pause_gc=True)
+        self.assertEqual(seen, [True, False])
+        self.assertTrue(gc.isenabled())
+        # a collector turned off by the caller stays off
+        gc.disable()
+        decoders.loads(self.doc, 'spy', pause_gc=True)
+        self.assertFalse(gc.isenabled())
+
+    def test_load_file(self):
+        for name in decoders.available() + ['auto']:
+            with open(self.path, 'rb') as fp:
+                self.assertEqual(decoders.load(fp, name), self.obj, name)
+            with open(self.path) as fp:
+                self.assertEqual(decoders.load(fp, name), self.obj, name)
+
+    def test_load_file_objects(self):
+        self.assertEqual(decoders.load(io.BytesIO(self.doc)), self.obj)
+        self.assertEqual(decoders.load(io.StringIO(self.doc.decode('utf-8'))),
+                         self.obj)
+
+    def test_load_from_offset(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'header\n' + self.doc)
+        for name in decoders.available():
+            with open(self.path, 'rb') as fp:
+                fp.readline()
+                self.assertEqual(decoders.load(fp, name), self.obj, name)
+
+    def test_unknown_decoder(self):
+        self.assertRaises(ValueError, decoders.loads, self.doc, 'nope')
+        self.assertRaises(ValueError, decoders.get, 'nope')
+
+    def test_invalid_document(self):
+        self.assertRaises(ValueError, decoders.loads, b'{"a": ', 'auto')
+        self.assertRaises(ValueError, decoders.loads, b'{"a": ', 'json')
+
+    def test_auto_reads_small_documents_with_json(self):
+        imported = dict(decoders._decoders)
+        self.addCleanup(decoders._decoders.update, imported)
+        decoders._decoders.clear()
+        self.assertEqual(decoders._choose('auto', 100)[0], 'json')
+        self.assertEqual(decoders._choose('auto', decoders._SMALL)[0],
+                         decoders._fastest())
+        # once a faster decoder is imported, it is used for everything
+        self.assertEqual(decoders._choose('auto', 100)[0],
+                         decoders._fastest())
+
+    def test_fallback(self):
+        self.assertTrue(math.isnan(decoders.loads(b'[NaN]')[0]))
+
+    def test_register(self):
+        calls = []
+
+        def factory():
+            def loads(data):
+                calls.append(type(data))
+                return decoders.loads(data, 'json')
+            return loads
+
+        decoders.register('test', factory)
+        self.addCleanup(decoders._factories.pop, 'test')
+        self.addCleanup(decoders._decoders.pop, 'test', None)
+        self.assertIn('test', decoders.available())
+        with open(self.path, 'rb') as fp:
+            self.assertEqual(decoders.load(fp, 'test'), self.obj)
+        self.assertEqual(decoders.loads(bytearray(self.doc), 'test'),
+                         self.obj)
+        self.assertEqual(calls, [bytes, bytes])
+
+    def test_uninstalled(self):
+        def factory():
+            raise ImportError
+        decoders.register('missing', factory)
+        self.addCleanup(decoders._factories.pop, 'missing')
+        self.addCleanup(decoders._decoders.pop, 'missing', None)
+        self.assertNotIn('missing', decoders.available())
+        self.assertRaises(ValueError, decoders.get, 'missing')
@@ -1,3 +1,6 @@
+import collections
+import subprocess
+import sys
 from unittest import TestCase
 from jsonselect import jsonselect
 
@@ -19,3 +22,323 @@ class TestJsonselect(TestCase):
 
     def test_no_results_returns_none(self):
         self.assertEquals(jsonselect.select('.foobar', self.obj), None)
+
+    def test_compile_returns_reusable_selector(self):
+        selector = jsonselect.compile('.x')
+        self.assertEqual(selector.select(self.obj), 'y')
+        self.assertEqual(selector.select({'x': 1}), 1)
+        self.assertEqual([node.value for node in selector.match(self.obj)],
+                         ['y'])
+
+    def test_compile_is_cached(self):
+        jsonselect.purge()
+        self.assertTrue(jsonselect.compile('.foo') is
+                        jsonselect.compile('.foo'))
+
+    def test_select_accepts_compiled_selector(self):
+        selector = jsonselect.compile('.foo')
+        self.assertEqual(jsonselect.select(selector, self.obj), [1, 2, 3])
+
+    def test_compile_raises_syntax_error(self):
+        self.assertRaises(jsonselect.SelectorSyntaxError,
+                          jsonselect.compile, 'gibberish')
+
+    def test_cache_is_bounded(self):
+        cache = jsonselect._LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_descendant_chain(self):
+        obj = {'a': {'b': {'c': {'d': 1}}, 'd': 2}}
+        self.assertEqual(jsonselect.select('.a .b .c > .d', obj), 1)
+        self.assertEqual(jsonselect.select('.a .d', obj), [1, 2])
+
+    def test_grouping_binds_loosest(self):
+        obj = {'a': {'b': 1}, 'c': 2, 'b': 3}
+        self.assertEqual(sorted(jsonselect.select('.a > .b, .c', obj)),
+                         [1, 2])
+
+    def test_sibling(self):
+        obj = {'a': 1, 'b': 'x', 'c': {'d': 2}}
+        self.assertEqual(jsonselect.select('.a ~ string', obj), 'x')
+        self.assertEqual(jsonselect.select('.b ~ .b', obj), None)
+
+    def test_whitespace_is_descendant_combinator(self):
+        obj = {'foo': {'foo': 1}}
+        self.assertEqual(jsonselect.select('object .foo', obj),
+                         [1, {'foo': 1}])
+        self.assertEqual(jsonselect.select('object.foo', obj), {'foo': 1})
+
+    def test_joins_compare_nodes_by_identity(self):
+        # both subtrees are equal in value, but only one is under .a
+        obj = {'a': {'x': [1]}, 'b': {'x': [1]}}
+        nodes = list(jsonselect.object_iter(obj))
+        a = [node for node in nodes if node.parent_key == 'a']
+        x = [node for node in nodes if node.parent_key == 'x']
+        ones = [node for node in nodes if node.value == 1]
+
+        self.assertEqual(len(jsonselect.Parser.parents(a, x)), 1)
+        self.assertEqual(len(jsonselect.Parser.ancestors(a, ones)), 1)
+        self.assertEqual(jsonselect.Parser.siblings(x, x), [])
+
+    def test_has_matches_descendants(self):
+        obj = {'a': {'b': {'error': 1}}, 'c': {'d': 2}}
+        self.assertEqual(jsonselect.select('.a:has(.error)', obj),
+                         {'b': {'error': 1}})
+        self.assertEqual(jsonselect.select('object:has(.error)', obj),
+                         [{'error': 1}, {'b': {'error': 1}}, obj])
+
+    def test_has_is_scoped_to_candidate(self):
+        obj = {'a': {'b': 1}, 'c': {'d': 2}}
+        self.assertEqual(jsonselect.select('.c:has(.a .b)', obj), None)
+        self.assertEqual(jsonselect.select('object:has(:root > .b)', obj),
+                         {'b': 1})
+
+    def test_iselect_is_lazy(self):
+        matches = jsonselect.iselect('number', self.obj)
+        self.assertEqual(next(matches), 1)
+        self.assertEqual(list(matches), [2, 3])
+
+    def test_select_first(self):
+        self.assertEqual(jsonselect.select_first('number', self.obj), 1)
+        self.assertEqual(jsonselect.select_first('.nope', self.obj, 0), 0)
+
+    def test_exists_stops_early(self):
+        seen = []
+
+        class Spy(dict):
+            def __iter__(self):
+                seen.append(self)
+                return dict.__iter__(self)
+
+        obj = [{'error': 1}, Spy(a=1)]
+        self.assertTrue(jsonselect.exists('.error', obj))
+        self.assertEqual(seen, [])
+        self.assertFalse(jsonselect.exists('.nope', obj))
+        self.assertEqual(len(seen), 1)
+
+    def test_lazy_api_raises_syntax_error(self):
+        self.assertRaises(jsonselect.SelectorSyntaxError,
+                          jsonselect.iselect, 'gibberish', self.obj)
+
+    def test_deep_documents_dont_recurse(self):
+        obj = 1
+        for _ in range(sys.getrecursionlimit() * 2):
+            obj = {'a': [obj]}
+        self.assertEqual(jsonselect.select('.a > number', obj), 1)
+        self.assertTrue(jsonselect.exists('object:has(number)', obj))
+        self.assertEqual(sum(1 for _ in jsonselect.object_iter(obj)),
+                         sys.getrecursionlimit() * 4 + 1)
+
+    def test_document_matches_like_object(self):
+        obj = {'a': [{'b': 1, 'c': True}, {'b': 'x'}, [{'b': 2}]],
+               'b': {'a': {'b': 3}}}
+        document = jsonselect.Document(obj)
+        for selector in ('.b', 'number', '.a .b', '.a > * > .b', '.b ~ .c',
+                         'object:has(.b)', ':nth-child(2)', '.a number',
+                         ':root > .b', '.b:val(1), .c'):
+            self.assertEqual(jsonselect.select(selector, document),
+                             jsonselect.select(selector, obj), selector)
+
+    def test_document_looks_up_candidates(self):
+        document = jsonselect.Document({'a': [1, {'b': 2}], 'b': True})
+        self.assertEqual(document.keys['b'], [4, 5])
+        self.assertEqual(document.match('.b')[0].value, 2)
+        self.assertEqual(document.select('.nope'), None)
+
+    def test_selector_facts(self):
+        selector = jsonselect.compile(':root > .config > .timeout')
+        self.assertEqual(selector.required_keys,
+                         frozenset(['config', 'timeout']))
+        self.assertFalse(selector.matches_in_arrays)
+        self.assertEqual(selector.max_depth, 2)
+
+        selector = jsonselect.compile('.a ~ .b number, .b > .c')
+        self.assertEqual(selector.required_keys, frozenset(['b']))
+        self.assertTrue(selector.matches_in_arrays)
+        self.assertEqual(selector.max_depth, None)
+
+    def test_pruned_subtrees_are_not_visited(self):
+        class Untouchable(dict):
+            def __iter__(self):
+                raise AssertionError('visited a pruned subtree')
+
+        obj = {'data': Untouchable(a=1), 'config': {'timeout': 5},
+               'rows': [1, 2, Untouchable(b=2)]}
+        self.assertEqual(
+            jsonselect.select(':root > .config > .timeout', obj), 5)
+        self.assertEqual(jsonselect.select(':root > .rows', obj),
+                         obj['rows'])
+
+    def test_batched_arrays_match_like_nodes(self):
+        obj = {'rows': list(range(40)) + ['a', 'b', True, None, {'x': 3},
+                                          [1, 2]] * 5}
+        selectors = (':expr(x <= 10)', 'number:nth-child(3n+1)',
+                     ':val("a"), .rows > :last-child', 'object:has(.x)',
+                     '.rows > * > number', ':expr(x >= 2 && x != 5)')
+        batched = [jsonselect.select(selector, obj)
+                   for selector in selectors]
+        batch_size = jsonselect._BATCH_SIZE
+        jsonselect._BATCH_SIZE = len(obj['rows']) + 1
+        try:
+            single = [jsonselect.select(selector, obj)
+                      for selector in selectors]
+        finally:
+            jsonselect._BATCH_SIZE = batch_size
+        self.assertEqual(batched, single)
+
+    def test_numpy_expr_mask(self):
+        if not jsonselect._import_numpy():
+            self.skipTest('numpy is not installed')
+        obj = [list(range(100)), [0.5, 1.5, True], [1, 2 ** 60, 2 ** 60 + 1]]
+        self.assertEqual(jsonselect.select(':expr(x <= 2 || x = 99)', obj),
+                         [0, 1, 2, 99, 0.5, 1.5, True, 1])
+        self.assertEqual(
+            jsonselect.select(':expr(x = 1152921504606846977)', obj),
+            2 ** 60 + 1)
+
+    def test_plain_selectors(self):
+        # ordered, as the order of the matches follows that of the keys
+        obj = collections.OrderedDict([
+            ('a', collections.OrderedDict([('b', [1, {'b': 'x'}]),
+                                           ('c', {'a': {'b': True}})])),
+            ('b', 2)])
+        for selector, expected in (('.b', ['x', [1, {'b': 'x'}], True, 2]),
+                                   ('.a > .b', [[1, {'b': 'x'}], True]),
+                                   ('.a .b', ['x', [1, {'b': 'x'}], True]),
+                                   ('object string, boolean', ['x', True])):
+            selector = jsonselect.compile(selector)
+            self.assertTrue(selector.program.plain)
+            self.assertEqual(selector.select(obj), expected)
+
+        node = jsonselect.compile('.a array > object').match(obj)[0]
+        self.assertEqual((node.parent_key, node.idx, node.siblings),
+                         (None, 2, 2))
+        self.assertEqual(node.parent.parent_key, 'b')
+        self.assertEqual(node.parent.parent.parent_key, 'a')
+        self.assertFalse(jsonselect.compile('.a ~ .b').program.plain)
+
+    def test_selectors_are_shared_between_threads(self):
+        import threading
+        obj = {'rows': [{'id': i, 'tags': ['a'] * (i % 3)}
+                        for i in range(200)]}
+        selectors = [jsonselect.compile(selector) for selector in (
+            '.id', 'object:has(.tags > string) > .id',
+            '.rows > :nth-child(odd) .id', ':expr(x >= 150)', '.id ~ array')]
+        document = jsonselect.Document(obj)
+        expected = [selector.select(obj) for selector in selectors]
+        failures = []
+
+        def run():
+            for _ in range(10):
+                for target in (obj, document):
+                    results = [selector.select(target)
+                               for selector in selectors]
+                    if results != expected:
+                        failures.append(results)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+    def test_collect_stats(self):
+        jsonselect.purge()
+        obj = {'a': [{'b': 1}, {'b': 'x'}], 'c': {'b': 2}}
+        evaluations = []
+        with jsonselect.collect_stats(evaluations.append) as stats:
+            self.assertEqual(jsonselect.select('.a .b', obj), [1, 'x'])
+            self.assertEqual(jsonselect.select('.a .b', obj), [1, 'x'])
+            self.assertTrue(jsonselect.exists('object:has(number)', obj))
+        self.assertEqual(len(evaluations), 3)
+        first = evaluations[0]
+        self.assertEqual((first.compiles, first.cache_hits, first.matches),
+                         (1, 0, 2))
+        self.assertEqual(evaluations[1].compiles, 0)
+        self.assertEqual(evaluations[1].cache_hits, 1)
+        # the root, 'a', its two objects and their 'b's, and 'c', which
+        # is walked into but has no child worth visiting
+        self.assertEqual(first.nodes_visited, 7)
+        self.assertEqual(first.passed, {' ': 1})
+        self.assertIn('has', evaluations[2].calls)
+        self.assertEqual(stats.evaluations, 3)
+        self.assertEqual(stats.matches, 5)
+        self.assertEqual(stats.calls['key'], sum(
+            evaluation.calls.get('key', 0) for evaluation in evaluations))
+        self.assertTrue(stats.lex_time > 0 and stats.match_time > 0)
+
+        # nothing is collected outside the block
+        jsonselect.select('.a .b', obj)
+        self.assertEqual(stats.evaluations, 3)
+
+    def test_limits(self):
+        obj = {'a': [{'b': i} for i in range(50)],
+               'deep': [[[[[1]]]]]}
+        with jsonselect.limits(max_results=10):
+            with self.assertRaises(jsonselect.LimitExceeded) as caught:
+                jsonselect.select('.b', obj)
+        self.assertEqual(caught.exception.limit, 'max_results')
+        self.assertEqual(caught.exception.stats.matches, 11)
+
+        for target in (obj, jsonselect.Document(obj)):
+            with jsonselect.limits(max_nodes_visited=20):
+                with self.assertRaises(jsonselect.LimitExceeded) as caught:
+                    jsonselect.select('.b', target)
+            self.assertEqual(caught.exception.limit, 'max_nodes_visited')
+
+        with jsonselect.limits(max_depth=3):
+            with self.assertRaises(jsonselect.LimitExceeded) as caught:
+                jsonselect.select('number', obj)
+        self.assertEqual(caught.exception.limit, 'max_depth')
+
+        with jsonselect.limits(timeout=0):
+            self.assertRaises(jsonselect.LimitExceeded,
+                              jsonselect.select, '.b', obj)
+
+        # within the limits, nothing changes, and blocks nest
+        expected = jsonselect.select('.b', obj)
+        with jsonselect.limits(max_results=100, timeout=60) as outer:
+            with jsonselect.limits(max_nodes_visited=10 ** 6):
+                self.assertEqual(jsonselect.select('.b', obj), expected)
+            self.assertEqual(jsonselect.select('.b', obj), expected)
+        self.assertEqual(outer.matches, 100)
+        self.assertEqual(jsonselect.select('.b', obj), expected)
+
+    def test_stats_dont_change_results(self):
+        obj = {'rows': list(range(40)) + [{'x': 3}, [1, 'a']] * 5,
+               'b': {'x': 'y'}}
+        document = jsonselect.Document(obj)
+        selectors = ('.x', ':expr(x <= 10)', 'object:has(.x) > *',
+                     '.rows > :nth-child(odd)', 'number ~ array string')
+        for target in (obj, document):
+            expected = [jsonselect.select(selector, target)
+                        for selector in selectors]
+            with jsonselect.collect_stats() as stats:
+                self.assertEqual([jsonselect.select(selector, target)
+                                  for selector in selectors], expected)
+            self.assertTrue(stats.nodes_visited)
+        self.assertEqual([join[0] for join in stats.joins],
+                         ['>', '>', '~', ' '])
+
+    def test_import_is_lazy(self):
+        code = ('import sys, jsonselect; '
+                'print(sorted(m for m in sys.modules '
+                'if m.startswith("jsonselect") or m == "logging")); '
+                'jsonselect.select; '
+                'print("jsonselect.jsonselect" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        if sys.version_info >= (3, 7):
+            self.assertEqual(output.split(), [b"['jsonselect']", b'True'])
+
+    def test_submodule_is_reachable(self):
+        code = ('import jsonselect; '
+                'print(jsonselect.jsonselect.Parser.__name__)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.split(), [b'Parser'])
@@ -0,0 +1,28 @@
+import json
+from unittest import TestCase
+from jsonselect.lines import select_lines
+
+
+class TestLines(TestCase):
+
+    def setUp(self):
+        self.lines = [json.dumps({'id': i, 'ok': i % 2 == 0})
+                      for i in range(25)]
+        self.expected = [json.dumps(i) for i in range(25)]
+
+    def test_one_result_per_line(self):
+        self.assertEqual(list(select_lines('.id', self.lines,
+                                           chunk_size=4)),
+                         self.expected)
+
+    def test_jobs_keep_order(self):
+        self.assertEqual(list(select_lines('.id', self.lines, jobs=2,
+                                           chunk_size=3)),
+                         self.expected)
+
+    def test_blank_and_unmatched_lines(self):
+        self.assertEqual(list(select_lines('.id', ['{}', '', '{"id": 1}'])),
+                         ['null', 'null', '1'])
+
+    def test_invalid_json(self):
+        self.assertRaises(ValueError, list, select_lines('.id', ['{']))
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from jsonselect import parallel, compile, select
+
+
+class TestParallel(TestCase):
+
+    def setUp(self):
+        self.obj = [
+            {'id': 1, 'name': 'a "quoted" [name]', 'tags': ['x', 'y']},
+            [1, 2.5, {'id': 2}],
+            u'caf\u00e9 \\ {',
+            {'id': 3, 'name': 'c', 'tags': []},
+            12345678,
+            {'name': 'd', 'id': 4},
+        ]
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.write(self.obj)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, obj, **kwargs):
+        with open(self.path, 'w') as f:
+            json.dump(obj, f, **kwargs)
+
+    def assertMatchesLikeSelect(self, selector):
+        # decoded from the file, so objects iterate as the processes see
+        # them on Pythons whose dicts don't keep their order
+        with open(self.path) as f:
+            obj = json.load(f)
+        expected = [(node.path(), node.value)
+                    for node in compile(selector).match(obj)]
+        # ranges of a few bytes split strings, numbers and escapes
+        for chunk_size in (1, 7, 30):
+            self.assertEqual(list(parallel.iter_matches(
+                selector, self.path, jobs=2, chunk_size=chunk_size)),
+                expected, (selector, chunk_size))
+
+    def test_matches_like_select(self):
+        for selector in ['.id', 'number', 'string', '.tags > *',
+                         'array > object', '.name:contains("[")',
+                         ':root > :nth-child(odd)', ':last-child',
+                         ':root > object ~ number', '.id ~ .name',
+                         ':root > :first-child ~ object > .id',
+                         'object:has(.tags)', ':root > *']:
+            self.assertMatchesLikeSelect(selector)
+
+    def test_matches_needing_the_whole_document(self):
+        for selector in ['*', ':root', 'array', ':root:has(.id) > object']:
+            self.assertMatchesLikeSelect(selector)
+
+    def test_other_documents(self):
+        self.obj = {'items': self.obj}
+        self.write(self.obj, indent=2)
+        self.assertMatchesLikeSelect('.items > * > .id')
+        self.obj = []
+        self.write(self.obj)
+        self.assertMatchesLikeSelect('*')
+
+    def test_select(self):
+        self.assertEqual(parallel.select('.id', self.path, jobs=2,
+                                         chunk_size=16),
+                         select('.id', self.obj))
+        self.assertEqual(parallel.select('.nothing', self.path, jobs=2,
+                                         chunk_size=16), None)
+
+    def test_invalid_document(self):
+        with open(self.path, 'w') as f:
+            f.write('[{"a": 1}, {"a": 2]]')
+        self.assertRaises(ValueError, list, parallel.iter_matches(
+            '.a', self.path, jobs=2, chunk_size=4))
@@ -0,0 +1,92 @@
+from unittest import TestCase
+from jsonselect import jsonselect, paths
+
+
+class TestPaths(TestCase):
+
+    def setUp(self):
+        self.obj = {
+            'items': [{'id': 1, 'tags': ['x', 'y']}, {'id': 2}, 3],
+            'a/b': {'~': True},
+        }
+
+    def test_select_paths(self):
+        self.assertEqual(paths.select_paths('.id', self.obj),
+                         [('items', 0, 'id'), ('items', 1, 'id')])
+        self.assertEqual(paths.select_paths(':root', self.obj), [()])
+        self.assertEqual(paths.select_paths('.nope', self.obj), [])
+
+    def test_select_pointers(self):
+        self.assertEqual(paths.select_pointers('boolean', self.obj),
+                         ['/a~1b/~0'])
+        self.assertEqual(paths.select_pointers('.tags string', self.obj),
+                         ['/items/0/tags/0', '/items/0/tags/1'])
+        self.assertEqual(paths.select_pointers(':root', self.obj), [''])
+
+    def test_paths_lead_to_matches(self):
+        selectors = ['*', 'number', '.items > *', ':has(.id)', '.id ~ *',
+                     'string:last-child']
+        for selector in selectors:
+            values = [node.value for node in
+                      jsonselect.compile(selector).match(self.obj)]
+            for found in (paths.select_paths(selector, self.obj),
+                          paths.select_pointers(selector, self.obj)):
+                self.assertEqual([paths.get_path(self.obj, path)
+                                  for path in found], values, selector)
+
+    def test_document_paths(self):
+        document = jsonselect.Document(self.obj)
+        self.assertEqual(paths.select_pointers('.id', document),
+                         ['/items/0/id', '/items/1/id'])
+
+    def test_split_pointer(self):
+        self.assertEqual(paths.split_pointer(''), [])
+        self.assertEqual(paths.split_pointer('/a~1b/~0/0/'),
+                         ['a/b', '~', '0', ''])
+        self.assertRaises(ValueError, paths.split_pointer, 'a')
+
+    def test_get_path_missing(self):
+        self.assertRaises(KeyError, paths.get_path, self.obj, '/nope')
+        self.assertRaises(IndexError, paths.get_path, self.obj, '/items/3')
+        self.assertRaises(KeyError, paths.get_path, self.obj, '/items/01')
+        self.assertRaises(KeyError, paths.get_path, self.obj, '/items/-')
+
+    def test_set_path(self):
+        self.assertIs(paths.set_path(self.obj, '/items/1/id', 5), self.obj)
+        self.assertEqual(self.obj['items'][1], {'id': 5})
+        paths.set_path(self.obj, ('items', 2), 'z')
+        self.assertEqual(self.obj['items'][2], 'z')
+        paths.set_path(self.obj, '/a~1b/new', None)
+        self.assertEqual(self.obj['a/b'], {'~': True, 'new': None})
+        self.assertEqual(paths.set_path(self.obj, '', 1), 1)
+
+    def test_delete_path(self):
+        paths.delete_path(self.obj, '/items/0/tags/0')
+        paths.delete_path(self.obj, ('a/b',))
+        self.assertEqual(self.obj, {'items': [{'id': 1, 'tags': ['y']},
+                                              {'id': 2}, 3]})
+        self.assertRaises(ValueError, paths.delete_path, self.obj, '')
+
+    def test_update(self):
+        result = paths.update('number', self.obj, lambda x: x * 10)
+        self.assertIs(result, self.obj)
+        self.assertEqual(self.obj['items'],
+                         [{'id': 10, 'tags': ['x', 'y']}, {'id': 20}, 30])
+        self.assertEqual(paths.update(':root', self.obj, len), 2)
+
+    def test_update_innermost_first(self):
+        paths.update('object', self.obj, lambda x: sorted(x))
+        self.assertEqual(self.obj, {'items': [['id', 'tags'], ['id'], 3],
+                                    'a/b': ['~']})
+
+    def test_delete(self):
+        self.assertEqual(paths.delete('.items > :nth-child(odd)', self.obj),
+                         2)
+        self.assertEqual(self.obj['items'], [{'id': 2}])
+        self.assertEqual(paths.delete('.nope', self.obj), 0)
+
+    def test_delete_nested(self):
+        self.assertEqual(paths.delete('.items *', self.obj), 3)
+        self.assertEqual(self.obj['items'], [])
+        self.assertRaises(ValueError, paths.delete, '*', self.obj)
+        self.assertEqual(self.obj['a/b'], {'~': True})
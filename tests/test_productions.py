@@ -20,3 +20,54 @@ class TestPclassFuncArgs(TestCase):
 
     def test_eval_args(self):
         self.assertEquals(self.parser.expr_production("(1 + 2)")(None), 3)
+
+    def test_expr_precedence(self):
+        self.assertEqual(self.parser.expr_production("(1 + 2 * 3)")(None), 7)
+        self.assertEqual(
+            self.parser.expr_production("((1 + 2) * 3)")(None), 9)
+        self.assertEqual(self.parser.expr_production("(7 - 2 - 1)")(None), 4)
+
+    def test_expr_x(self):
+        validate = self.parser.expr_production("(x-1 >= 2 && x <= 9)")
+        node = jsonselect.Node(4, None, None, None, None)
+        self.assertTrue(validate(node))
+        self.assertFalse(validate(jsonselect.Node(1, None, None, None, None)))
+
+    def test_lex_balanced_parens(self):
+        tokens = jsonselect.lex(':expr((x + (1)) * 2 = ")")')
+        self.assertEqual(
+            tokens,
+            [('pclass_func', 'expr'), ('expr', '((x + (1)) * 2 = ")")')]
+        )
+        self.assertRaises(jsonselect.LexingError,
+                          jsonselect.lex, ':expr((x + 1)')
+
+    def test_expr_syntax_error(self):
+        self.assertRaises(jsonselect.SelectorSyntaxError,
+                          self.parser.expr_production, "(x +)")
+        self.assertRaises(jsonselect.SelectorSyntaxError,
+                          self.parser.expr_production, "(x 1)")
+
+    def test_lex_error_position(self):
+        # including when nothing at all could be lexed
+        for selector, position in (('.a > #b', 5), (':foo', 0)):
+            try:
+                jsonselect.lex(selector)
+            except jsonselect.LexingError as e:
+                self.assertIn('position %d' % position, str(e))
+            else:
+                self.fail('LexingError not raised')
+        self.assertRaises(jsonselect.LexingError, jsonselect.lex, '')
+
+    def test_lex_results_are_not_shared(self):
+        tokens = jsonselect.lex('.a > .b')
+        tokens.pop()
+        self.assertEqual(jsonselect.lex('.a > .b'),
+                         [('identifier', 'a'), ('operator', '>'),
+                          ('identifier', 'b')])
+
+    def test_expr_literals(self):
+        self.assertEqual(jsonselect.lex_expr('(-1e3 1 2.5 "a\\"b" null)'),
+                         [('paren', '('), ('number', -1000.0), ('number', 1),
+                          ('number', 2.5), ('string', 'a"b'),
+                          ('val', None), ('paren', ')')])
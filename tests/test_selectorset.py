@@ -0,0 +1,57 @@
+from unittest import TestCase
+from jsonselect import jsonselect
+from jsonselect.selectorset import SelectorSet
+
+
+class TestSelectorSet(TestCase):
+
+    def setUp(self):
+        self.obj = {
+            'name': 'a',
+            'items': [{'id': 1, 'tags': ['x']}, {'id': 2, 'name': 'b'}],
+            'meta': {'id': 3, 'ok': True},
+        }
+        self.rules = {
+            'ids': '.id',
+            'item_ids': '.items .id',
+            'item_names': '.items > * > .name',
+            'named': 'object:has(.name) > .id',
+            'after_id': '.id ~ *',
+            'numbers': 'number',
+            'none': '.nope',
+            'grouped': '.tags string, .ok',
+        }
+
+    def test_matches_like_separate_selectors(self):
+        results = SelectorSet(self.rules).select(self.obj)
+        for rule_id, selector in self.rules.items():
+            expected = [node.value for node in
+                        jsonselect.compile(selector).match(self.obj)]
+            self.assertEqual(results.get(rule_id, []), expected, rule_id)
+        self.assertNotIn('none', results)
+
+    def test_shared_prefixes_share_states(self):
+        rules = SelectorSet([(1, '.items .id'), (2, '.items .name'),
+                             (3, '.items .id')])
+        self.assertEqual(len(rules.simples), 3)
+        self.assertEqual(rules.select(self.obj),
+                         {1: [1, 2], 2: ['b'], 3: [1, 2]})
+
+    def test_rules_added_later(self):
+        def values(selector):
+            return [node.value for node in
+                    jsonselect.compile(selector).match(self.obj)]
+
+        rules = SelectorSet()
+        rules.add('a', '.name')
+        self.assertEqual(rules.select(self.obj), {'a': values('.name')})
+        rules.add('a', '.ok')
+        rules.add('b', ':root')
+        # like joining them with ','
+        self.assertEqual(rules.select(self.obj)['a'], values('.name, .ok'))
+        self.assertEqual(rules.match(self.obj)['b'][0].value, self.obj)
+        self.assertEqual(len(rules), 2)
+
+    def test_invalid_selector(self):
+        self.assertRaises(jsonselect.SelectorSyntaxError,
+                          SelectorSet, {'bad': 'gibberish'})
@@ -0,0 +1,79 @@
+import collections
+import io
+import json
+from unittest import TestCase
+from jsonselect import jsonselect
+from jsonselect.stream import stream_select
+
+
+class TestStream(TestCase):
+
+    def setUp(self):
+        with io.open('conformance_tests/custom/basic.json',
+                     encoding='utf-8') as f:
+            self.text = f.read()
+        # in the order of the file, as streamed matches are
+        self.obj = json.loads(self.text,
+                              object_pairs_hook=collections.OrderedDict)
+
+    def assertStreams(self, selector, chunk_size=7):
+        expected = [node.value for node in
+                    jsonselect.compile(selector).match(self.obj)]
+        for fp in (io.StringIO(self.text),
+                   io.BytesIO(self.text.encode('utf-8'))):
+            self.assertEqual(
+                list(stream_select(selector, fp, chunk_size=chunk_size)),
+                expected)
+
+    def test_matches_select(self):
+        for selector in ('string', '.languagesSpoken .language',
+                         ':root > object', '.languagesSpoken > object',
+                         'string:first-child', ':nth-child(2)',
+                         ':contains("el")', 'number:expr(x > 100)',
+                         ':root', '.name, .weight'):
+            self.assertStreams(selector)
+
+    def test_small_chunks(self):
+        self.assertStreams('*', chunk_size=1)
+
+    def test_rejects_unstreamable_selectors(self):
+        for selector in (':last-child', 'object:has(.level)', '.a ~ .b',
+                         ':empty', ':nth-last-child(1)'):
+            self.assertRaises(ValueError, list,
+                              stream_select(selector, io.StringIO(u'[]')))
+
+    def test_rejects_invalid_json(self):
+        for text in (u'', u'[1,]', u'{"a" 1}', u'[1] 2', u'"abc', u'nul'):
+            self.assertRaises(ValueError, list,
+                              stream_select('*', io.StringIO(text)))
+
+    def test_scalars(self):
+        text = u'[0, -1.5e3, "a\\\\\\"b", true, false, null, {}]'
+        self.assertEqual(list(stream_select(':root > *', io.StringIO(text),
+                                            chunk_size=2)),
+                         json.loads(text))
+
+    def test_tokens_split_between_reads(self):
+        text = (u'[12.5, 3e5, -0.25E-3, 1e+2, 0, true, false, null, '
+                u'"caf\u00e9 \u20ac", 7]')
+        expected = json.loads(text)
+        for data in (text, text.encode('utf-8')):
+            for at in range(1, len(data)):
+                self.assertEqual(
+                    list(stream_select(':root > *', _Split(data, at))),
+                    expected, at)
+        self.assertEqual(list(stream_select(
+            ':root > *', io.BytesIO(text.encode('utf-8')), chunk_size=1)),
+            expected)
+
+
+class _Split(object):
+
+    """A file object whose contents are read in two parts, split at at."""
+
+    def __init__(self, data, at):
+        self.parts = [data[:at], data[at:]]
+        self.empty = data[:0]
+
+    def read(self, size):
+        return self.parts.pop(0) if self.parts else self.empty
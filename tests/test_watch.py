@@ -0,0 +1,73 @@
+from unittest import TestCase
+from jsonselect import jsonselect
+from jsonselect.watch import WatchedDocument
+
+
+class TestWatchedDocument(TestCase):
+
+    def setUp(self):
+        self.doc = WatchedDocument({
+            'items': [{'id': 1, 'tags': ['a']}, {'id': 2}],
+            'meta': {'count': 2},
+        })
+        self.events = []
+
+    def assertCurrent(self, *selectors):
+        for selector in selectors:
+            expected = [(node.path(), node.value) for node in
+                        jsonselect.compile(selector).match(self.doc.obj)]
+            self.assertEqual(self.doc.matches(selector), expected, selector)
+
+    def test_watch_returns_matches(self):
+        self.assertEqual(self.doc.watch('.id'),
+                         [(('items', 0, 'id'), 1), (('items', 1, 'id'), 2)])
+
+    def test_set(self):
+        self.doc.watch('.id', self.events.append)
+        self.doc.set('/items/1/id', 5)
+        self.doc.set(('items', 0, 'name'), 'x')
+        self.assertEqual([(e.kind, e.path, e.value) for e in self.events],
+                         [('removed', ('items', 1, 'id'), 2),
+                          ('added', ('items', 1, 'id'), 5)])
+        self.assertCurrent('.id')
+
+    def test_insert_and_delete_shift_positions(self):
+        selectors = ['.items > :first-child .id', '.items > :last-child',
+                     'object:has(.tags) > .id', '.id ~ .tags', ':empty']
+        for selector in selectors:
+            self.doc.watch(selector, self.events.append)
+        self.doc.insert('/items/0', {'id': 0, 'tags': []})
+        self.assertCurrent(*selectors)
+        self.doc.insert('/items/-', {'id': 3})
+        self.assertCurrent(*selectors)
+        self.doc.delete('/items/0')
+        self.doc.delete('/items/0/tags')
+        self.assertCurrent(*selectors)
+        self.assertTrue(self.events)
+
+    def test_patch(self):
+        self.doc.watch('number', self.events.append)
+        self.doc.patch([
+            {'op': 'add', 'path': '/items/1/tags', 'value': [7]},
+            {'op': 'replace', 'path': '/meta', 'value': {}},
+            {'op': 'remove', 'path': '/items/0'},
+        ])
+        self.assertCurrent('number')
+        self.assertEqual(self.doc.obj, {'items': [{'id': 2, 'tags': [7]}],
+                                        'meta': {}})
+        self.assertRaises(KeyError, self.doc.patch,
+                          [{'op': 'replace', 'path': '/nope', 'value': 1}])
+        self.assertRaises(ValueError, self.doc.patch,
+                          [{'op': 'move', 'from': '/meta', 'path': '/m'}])
+
+    def test_replace_root(self):
+        self.doc.watch(':root > *')
+        self.doc.set('', [1, 2])
+        self.assertCurrent(':root > *')
+
+    def test_unwatch(self):
+        self.doc.watch('.id', self.events.append)
+        self.doc.unwatch('.id')
+        self.doc.set('/items/0/id', 3)
+        self.assertEqual(self.events, [])
+        self.assertRaises(KeyError, self.doc.matches, '.id')